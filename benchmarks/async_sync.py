@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Syncs a batch of vendors through the tally backend with every request taking
+``--latency`` seconds, comparing one sync at a time against services.async_sync
+with many syncs in flight under a shared semaphore.
+
+Usage:
+    python -m benchmarks.async_sync [--vendors 200] [--latency 0.05]
+"""
+
+import time
+import asyncio
+import argparse
+
+from integration import entities
+from integration import services
+from integration.backends import tally
+from integration.backends.tally import server
+
+
+def vendors(count: int):
+    currency = entities.Currency(id=1, name="CAD", rate=1)
+    location = entities.Location(id=1, name="Vancouver", localCurrency=currency)
+    return [
+        entities.Vendor(id=i, name=f"Vendor {i}", currency=currency, location=location)
+        for i in range(count)
+    ]
+
+
+async def sync_each(batch, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def sync(vendor):
+        results = services.async_sync(vendor, "tally", semaphore=semaphore)
+        return [result async for result in results]
+
+    await asyncio.gather(*(sync(vendor) for vendor in batch))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vendors", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    tally.LATENCY = args.latency
+    server.LocationStore.save({"name": "Vancouver"})
+    batch = vendors(args.vendors)
+
+    for concurrency in (1, 10, 100, 500):
+        server.VendorStore.reset()
+        tally.database.VendorObjectMap.reset()
+        tally.database.LocationObjectMap.reset()
+        start = time.perf_counter()
+        asyncio.run(sync_each(batch, concurrency))
+        elapsed = time.perf_counter() - start
+        rate = len(batch) / elapsed
+        print(f"{concurrency:4d} in flight {elapsed:8.2f} s {rate:10.0f} vendors/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Drives many threads against a single Datastore to measure throughput under
+contention. Each thread mixes point reads, full reads and writes.
+
+Usage:
+    python -m benchmarks.datastore_contention [--ops 20000] [--writes 0.1]
+"""
+
+import time
+import random
+import argparse
+import threading
+
+from integration import lib
+
+
+def worker(store, keys, ops, write_ratio, errors):
+    rng = random.Random()
+    for _ in range(ops):
+        try:
+            roll = rng.random()
+            if roll < write_ratio:
+                store.save({"local_id": rng.choice(keys), "remote_id": "x"})
+            elif roll < write_ratio + 0.01:
+                store.retrieve()
+            else:
+                store.retrieve(rng.choice(keys))
+        except lib.DatastoreException:
+            errors.append(1)
+
+
+def run(threads, ops, write_ratio, records):
+    store = lib.Datastore(
+        name="Benchmark", fields=("local_id", "remote_id"), pk="local_id"
+    )
+    keys = list(range(records))
+    for key in keys:
+        store.save({"local_id": key, "remote_id": "x"})
+
+    errors: list = []
+    pool = [
+        threading.Thread(target=worker, args=(store, keys, ops, write_ratio, errors))
+        for _ in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = threads * ops
+    print(
+        f"threads={threads:3d} ops={total:8d} "
+        f"ops/s={total / elapsed:12.0f} errors={len(errors)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ops", type=int, default=20000, help="Ops per thread.")
+    parser.add_argument("--writes", type=float, default=0.1, help="Write ratio.")
+    parser.add_argument("--records", type=int, default=1000)
+    args = parser.parse_args()
+
+    for threads in (1, 2, 4, 8, 16, 32):
+        run(threads, args.ops, args.writes, args.records)
+
+
+if __name__ == "__main__":
+    main()
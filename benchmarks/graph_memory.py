@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measures building the graph of a bill with many line items, and the memory
+held by the graph:
+
+- legacy: nodes with a __dict__ that deduplicate dependencies by scanning
+  their list of dependencies, which is quadratic in the number of items.
+- nodes: graph.Node, with __slots__ and a set of dependency identities.
+- compact: graph.CompactGraph built from the nodes, which keeps dependencies
+  in flat arrays.
+
+Usage:
+    python -m benchmarks.graph_memory [--items 20000]
+"""
+
+import time
+import typing
+import argparse
+import tracemalloc
+import dataclasses
+
+from integration import lib
+from integration import graph
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Currency(lib.SyncEntity):
+    pass
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Item(lib.SyncEntity):
+    currency: Currency
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Bill(lib.SyncEntity):
+    currency: Currency
+    items: typing.List[Item]
+
+
+class LegacyNode:
+    def __init__(self, entity):
+        self.entity = entity
+        self.deps = []
+        self.is_visited = False
+
+    def add_dependency(self, dep):
+        if dep not in self.deps:
+            self.deps.append(dep)
+
+
+def bill(items: int) -> Bill:
+    currency = Currency(local_id=1, remote_id=None)
+    return Bill(
+        local_id=1,
+        remote_id=None,
+        currency=currency,
+        items=[
+            Item(local_id=i, remote_id=None, currency=currency) for i in range(items)
+        ],
+    )
+
+
+def legacy_graph(root: Bill) -> LegacyNode:
+    node = LegacyNode(root)
+    currency = LegacyNode(root.currency)
+    node.add_dependency(currency)
+    for item in root.items:
+        dep = LegacyNode(item)
+        dep.add_dependency(currency)
+        node.add_dependency(dep)
+    return node
+
+
+def measure(name, build):
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+
+    # Tracing slows allocations down, so memory is measured on a second run.
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:8s} {elapsed * 1000:10.1f} ms {size / 2**20:8.1f} MiB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=20000)
+    args = parser.parse_args()
+
+    root = bill(args.items)
+    # Entities are shared by every representation, so only count the graph.
+    measure("legacy", lambda: legacy_graph(root))
+    node = measure("nodes", lambda: graph.generate_graph(root))
+    measure("compact", lambda: graph.CompactGraph(node))
+
+
+if __name__ == "__main__":
+    main()
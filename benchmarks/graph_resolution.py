@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Measures graph.resolve_dependencies on synthetic graphs:
+
+- wide: a bill with many items that all share one currency and account.
+- deep: a stack of diamonds where every level depends on both nodes of the
+  level below, so the number of paths doubles with each level.
+
+The previous breadth-first implementation is included for comparison on the
+sizes it can still handle.
+
+Usage:
+    python -m benchmarks.graph_resolution [--items 5000] [--levels 200]
+"""
+
+import time
+import typing
+import argparse
+import dataclasses
+
+from integration import lib
+from integration import graph
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Currency(lib.SyncEntity):
+    pass
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Account(lib.SyncEntity):
+    currency: Currency
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Item(lib.SyncEntity):
+    account: Account
+    currency: Currency
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Bill(lib.SyncEntity):
+    currency: Currency
+    items: typing.List[Item]
+
+
+@dataclasses.dataclass(eq=False, frozen=True)
+class Floor(lib.SyncEntity):
+    supports: typing.List["Floor"]
+
+
+def wide(items: int) -> Bill:
+    currency = Currency(local_id=1, remote_id=None)
+    account = Account(local_id=1, remote_id=None, currency=currency)
+    return Bill(
+        local_id=1,
+        remote_id=None,
+        currency=currency,
+        items=[
+            Item(local_id=i, remote_id=None, account=account, currency=currency)
+            for i in range(items)
+        ],
+    )
+
+
+def deep(levels: int) -> Floor:
+    below = [Floor(local_id=0, remote_id=None, supports=[])]
+    for level in range(1, levels):
+        below = [
+            Floor(local_id=level * 2 + i, remote_id=None, supports=below)
+            for i in range(2)
+        ]
+    return Floor(local_id=-1, remote_id=None, supports=below)
+
+
+def legacy_resolve_dependencies(node):
+    resolution = []
+    stack = [node]
+    while stack:
+        current = stack.pop(0)
+        stack.extend(current.deps)
+        resolution.append(current)
+
+    unique = []
+    while resolution:
+        node = resolution.pop()
+        if node in unique:
+            continue
+        unique.append(node)
+    return [node.entity for node in unique]
+
+
+def measure(name, root, resolve):
+    node = graph.generate_graph(root)
+    start = time.perf_counter()
+    order = resolve(node)
+    elapsed = time.perf_counter() - start
+    print(f"{name:36s} {len(order):7d} entities {elapsed * 1000:10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--levels", type=int, default=200)
+    args = parser.parse_args()
+
+    resolve = graph.resolve_dependencies
+    measure(f"wide ({args.items} items)", wide(args.items), resolve)
+    measure(f"deep ({args.levels} levels)", deep(args.levels), resolve)
+
+    print("legacy:")
+    measure("wide (1000 items)", wide(1000), legacy_resolve_dependencies)
+    measure("deep (12 levels)", deep(12), legacy_resolve_dependencies)
+
+
+if __name__ == "__main__":
+    main()
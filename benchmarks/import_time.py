@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Measures the cold start of a worker: a fresh interpreter importing
+integration.services, then loading the tally backend for its first sync.
+Backends are only imported on first use, so they are timed separately.
+
+Usage:
+    python -m benchmarks.import_time [--runs 10]
+"""
+
+import sys
+import argparse
+import statistics
+import subprocess
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+from integration import services
+imported = time.perf_counter()
+from integration.backends import get_backend
+get_backend("tally")
+loaded = time.perf_counter()
+print(imported - start, loaded - imported)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    imports, loads = [], []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True
+        ).stdout
+        imported, loaded = map(float, output.split())
+        imports.append(imported)
+        loads.append(loaded)
+
+    print(f"import services   {statistics.median(imports) * 1000:8.1f} ms")
+    print(f"load tally        {statistics.median(loads) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Measures insert throughput of a Datastore with each key allocation strategy,
+and how many retries random keys need as a small keyspace fills up.
+
+Usage:
+    python -m benchmarks.key_allocation [--records 200000] [--threads 4]
+"""
+
+import time
+import string
+import argparse
+import threading
+
+from integration import lib
+
+
+class CountingAllocator(lib.KeyAllocator):
+    def __init__(self, allocator):
+        self.allocator = allocator
+        self.collisions = 0
+
+    def allocate(self, exists):
+        def counting_exists(key):
+            taken = exists(key)
+            self.collisions += taken
+            return taken
+
+        return self.allocator.allocate(counting_exists)
+
+
+def run(name, allocator, records, threads):
+    store = lib.Datastore(name=name, fields=("id",), key_allocator=allocator)
+    per_thread = records // threads
+
+    def insert():
+        for _ in range(per_thread):
+            store.save({})
+
+    pool = [threading.Thread(target=insert) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    unique = len(store) == per_thread * threads
+    print(
+        f"{name:28s} {per_thread * threads / elapsed:10.0f} inserts/s "
+        f"unique={unique}"
+    )
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    run("random (a-z0-9, 6 chars)", lib.RandomKeyAllocator(), args.records, 1)
+    run("sequence", lib.SequenceKeyAllocator(), args.records, args.threads)
+    run("block", lib.BlockKeyAllocator(), args.records, args.threads)
+
+    counting = CountingAllocator(lib.RandomKeyAllocator(keyspace=string.digits))
+    run("random (0-9, 6 chars)", counting, args.records, 1)
+    print(f"  collisions retried: {counting.collisions}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Measures how long it takes to write object map entries to a LogStorage and to
+recover them when the process restarts.
+
+Usage:
+    python -m benchmarks.log_recovery [--records 1000000] [--batch 10000]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+
+from integration import lib
+from integration import storage
+
+
+def object_map(path):
+    return lib.Datastore(
+        name="Vendor",
+        fields=("local_id", "remote_id"),
+        pk="local_id",
+        storage=storage.LogStorage(path),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "vendor.log")
+
+        store = object_map(path)
+        start = time.perf_counter()
+        for offset in range(0, args.records, args.batch):
+            store.save_many(
+                {"local_id": i, "remote_id": f"{i:08x}"}
+                for i in range(offset, min(offset + args.batch, args.records))
+            )
+        elapsed = time.perf_counter() - start
+        print(f"write:   {args.records} records in {elapsed:.2f}s")
+        print(f"size:    {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+        start = time.perf_counter()
+        recovered = object_map(path)
+        elapsed = time.perf_counter() - start
+        print(f"recover: {len(recovered.retrieve())} records in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
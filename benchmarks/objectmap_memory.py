@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Compares memory use and point lookup speed of a dict of records against
+ObjectMapStorage when holding local_id -> remote_id mappings.
+
+Usage:
+    python -m benchmarks.objectmap_memory [--records 1000000]
+"""
+
+import time
+import random
+import argparse
+import tracemalloc
+
+from integration import storage
+
+
+def fill(table, records):
+    for i in range(records):
+        table[i] = {"local_id": i, "remote_id": f"{i:08x}"}
+    return table
+
+
+def measure(name, factory, records, lookups):
+    tracemalloc.start()
+    table = fill(factory(), records)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    keys = [random.randrange(records) for _ in range(lookups)]
+    start = time.perf_counter()
+    for key in keys:
+        table[key]
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:18s} {size / records:7.1f} bytes/mapping "
+        f"{lookups / elapsed:12.0f} lookups/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args()
+
+    measure("dict", dict, args.records, args.lookups)
+    measure("ObjectMapStorage", storage.ObjectMapStorage, args.records, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
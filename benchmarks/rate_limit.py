@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Syncs a batch of vendors from several threads against a tally server that
+allows ``--rate`` requests per second per endpoint. Compares relying on 429
+responses and retries alone against pacing requests with the backend's shared
+rate limiter set to the server's limit.
+
+Usage:
+    python -m benchmarks.rate_limit [--vendors 300] [--rate 200] [--threads 8]
+"""
+
+import time
+import argparse
+import collections
+from concurrent import futures
+
+from integration import lib
+from integration import entities
+from integration import services
+from integration.backends import tally
+from integration.backends.tally import server
+
+ENDPOINTS = ("/locations", "/vendors")
+
+
+def vendors(count: int):
+    currency = entities.Currency(id=1, name="CAD", rate=1)
+    location = entities.Location(id=1, name="Vancouver", localCurrency=currency)
+    return [
+        entities.Vendor(id=i, name=f"Vendor {i}", currency=currency, location=location)
+        for i in range(count)
+    ]
+
+
+def run(batch, threads: int):
+    with futures.ThreadPoolExecutor(threads) as executor:
+        results = executor.map(lambda v: list(services.sync(v, "tally")), batch)
+        return collections.Counter(result[-1].status for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vendors", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    server.LocationStore.save({"name": "Vancouver"})
+    batch = vendors(args.vendors)
+
+    throttled = collections.Counter()
+    handle_request = server.handle_request
+
+    def counting_handle_request(*a, **kw):
+        status, body = handle_request(*a, **kw)
+        throttled[status == 429] += 1
+        return status, body
+
+    server.handle_request = counting_handle_request
+
+    for limited in (False, True):
+        server.VendorStore.reset()
+        tally.database.VendorObjectMap.reset()
+        tally.database.LocationObjectMap.reset()
+        throttled.clear()
+        tally.rate_limiter.clear()
+        for endpoint in ENDPOINTS:
+            server.set_rate_limit(endpoint, args.rate, burst=10)
+            if limited:
+                tally.rate_limiter.configure(endpoint, args.rate, burst=10)
+
+        start = time.perf_counter()
+        statuses = run(batch, args.threads)
+        elapsed = time.perf_counter() - start
+        name = "rate limiter" if limited else "retries only"
+        failed = statuses[lib.SyncStatus.ERROR]
+        print(
+            f"{name:12s} {elapsed:6.2f} s {len(batch) / elapsed:8.0f} vendors/s "
+            f"{throttled[True]:6d} throttled {failed:4d} failed"
+        )
+
+
+if __name__ == "__main__":
+    main()
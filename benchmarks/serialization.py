@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Measures serializing and deserializing tally vendor bills with many items,
+against the previous serializers built on dataclasses.asdict, which copied
+every nested entity only to replace it with its remote id.
+
+Usage:
+    python -m benchmarks.serialization [--items 5000] [--repeat 5]
+"""
+
+import time
+import argparse
+import dataclasses
+
+from integration.backends.tally import entities
+
+
+def bill(items: int) -> entities.VendorBill:
+    currency = entities.Currency(
+        local_id=1, remote_id="c1", name="Canadian Dollar", iso_code="CAD"
+    )
+    location = entities.Location(local_id=1, remote_id="l1", name="Vancouver")
+    return entities.VendorBill(
+        local_id=1,
+        remote_id=None,
+        invoice="INV1",
+        account=entities.ChartOfAccounts(
+            local_id=1, remote_id="a1", number="1001", name="Supplies"
+        ),
+        vendor=entities.Vendor(
+            local_id=1, remote_id="v1", name="Staples", location=location
+        ),
+        currency=currency,
+        location=location,
+        department=entities.Department(local_id=1, remote_id="d1", name="Finance"),
+        items=[
+            entities.Item(
+                local_id=i,
+                remote_id=None,
+                description=f"Item {i}",
+                quantity=2,
+                rate=10,
+                total=20,
+                currency=currency,
+            )
+            for i in range(items)
+        ],
+    )
+
+
+def legacy_serialize_item(item):
+    ser = dataclasses.asdict(item)
+    ser["currency_id"] = item.currency.remote_id
+    return ser
+
+
+def legacy_serialize(bill):
+    ser = dataclasses.asdict(bill)
+    ser.update(
+        {
+            "account_id": bill.account.remote_id,
+            "vendor_id": bill.vendor.remote_id,
+            "currency_id": bill.currency.remote_id,
+            "location_id": bill.location.remote_id,
+            "department_id": bill.department.remote_id,
+            "items": [legacy_serialize_item(item) for item in bill.items],
+        }
+    )
+    return ser
+
+
+def legacy_deserialize(cls, data):
+    # What deserializing nested entities took without a generated function:
+    # inspecting the fields of the class on every call.
+    kwargs = {}
+    for field in dataclasses.fields(cls):
+        value = data[field.name]
+        if isinstance(value, dict):
+            value = legacy_deserialize(field.type, value)
+        elif isinstance(value, list):
+            item_class = field.type.__args__[0]
+            value = [legacy_deserialize(item_class, item) for item in value]
+        kwargs[field.name] = value
+    return cls(**kwargs)
+
+
+def measure(name, repeat, function):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:24s} {elapsed * 1000:10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    root = bill(args.items)
+    data = dataclasses.asdict(root)
+    cls = entities.VendorBill
+
+    measure("legacy serialize", args.repeat, lambda: legacy_serialize(root))
+    measure("generated serialize", args.repeat, root.serialize)
+    measure("legacy deserialize", args.repeat, lambda: legacy_deserialize(cls, data))
+    measure("generated deserialize", args.repeat, lambda: cls.deserialize(data))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Compares Datastore and ShardedDatastore throughput for an ObjectMap style
+workload, where each thread writes local_id -> remote_id mappings and reads
+them back, as the thread count grows.
+
+Shards only let writers run in parallel when threads can run in parallel.
+Under the GIL the sharded store does not scale and is somewhat slower than a
+single store because of the routing overhead. Expect gains only on a
+free-threaded interpreter.
+
+Usage:
+    python -m benchmarks.sharded_datastore [--ops 20000] [--shards 16]
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+from integration import lib
+
+
+def worker(store, offset, ops):
+    for i in range(offset, offset + ops):
+        store.save({"local_id": i, "remote_id": "x"})
+        store.retrieve(i)
+
+
+def run(store, threads, ops):
+    pool = [
+        threading.Thread(target=worker, args=(store, i * ops, ops))
+        for i in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return threads * ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ops", type=int, default=20000, help="Ops per thread.")
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    if gil_enabled:
+        print("GIL is enabled, sharding is not expected to scale.")
+
+    fields = ("local_id", "remote_id")
+    for threads in (1, 2, 4, 8, 16):
+        single = lib.Datastore(name="Vendor", fields=fields, pk="local_id")
+        sharded = lib.ShardedDatastore(
+            name="Vendor", fields=fields, pk="local_id", shard_count=args.shards
+        )
+        print(
+            f"threads={threads:3d} "
+            f"single ops/s={run(single, threads, args.ops):10.0f} "
+            f"sharded ops/s={run(sharded, threads, args.ops):10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
-import sys
 import logging
 
-logger = logging.getLogger(__name__)
-logger.addHandler(logging.StreamHandler(sys.stdout))
-logger.setLevel(logging.DEBUG)
+# Applications decide where log records go. Without any configuration, they
+# are dropped rather than written to stdout on import.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
@@ -1,13 +1,69 @@
 #!/usr/bin/env python3
+import types
+import typing
 import importlib
+import threading
 
 
 class BackendError(Exception):
     pass
 
 
-def get_backend(name):
-    try:
-        return importlib.import_module(f"integration.backends.{name}")
-    except ImportError:
+# Backends by name, with the module implementing each. Modules are only
+# imported once a backend is first used.
+_registry: typing.Dict[str, str] = {
+    "tally": "integration.backends.tally",
+}
+_loaded: typing.Dict[str, types.ModuleType] = {}
+_lock = threading.Lock()
+
+# Every backend module must define these.
+REQUIRED_ATTRIBUTES = ("mapping", "sync")
+
+
+def register_backend(name: str, module: str):
+    """Make the backend implemented by the given module available as
+    ``name``. The module is imported when the backend is first used."""
+
+    with _lock:
+        _registry[name] = module
+        _loaded.pop(name, None)
+
+
+def get_backend(name: str) -> types.ModuleType:
+    """Return the module of the given backend, importing and validating it on
+    first use.
+
+    Raises:
+        BackendError: Given backend does not exist or is incomplete.
+    """
+
+    backend = _loaded.get(name)
+    if backend is not None:
+        return backend
+
+    with _lock:
+        if name not in _loaded:
+            _loaded[name] = _load(name)
+        return _loaded[name]
+
+
+def _load(name: str) -> types.ModuleType:
+    if name not in _registry:
         raise BackendError(f"Integration backend '{name}' does not exist.")
+
+    path = _registry[name]
+    try:
+        backend = importlib.import_module(path)
+    except ModuleNotFoundError as e:
+        # Modules missing from within the backend are its own problem.
+        if e.name is None or not (path + ".").startswith(e.name + "."):
+            raise
+        raise BackendError(f"Integration backend '{name}' does not exist.") from e
+
+    for attribute in REQUIRED_ATTRIBUTES:
+        if not hasattr(backend, attribute):
+            raise BackendError(
+                f"Integration backend '{name}' does not define '{attribute}'."
+            )
+    return backend
@@ -1,9 +1,26 @@
+import os
 import typing
+import logging
+import functools
+import dataclasses
 from integration import lib
 from integration import entities as local_entities
 from integration.backends.tally import entities as remote_entities
+from integration.backends.tally import client
 from integration.backends.tally import database
 
+logger = logging.getLogger(__name__)
+
+# Seconds every request of the async client waits for, to simulate a remote
+# system over the network.
+LATENCY = float(os.environ.get("TALLY_LATENCY", 0))
+
+# Requests per endpoint of `mapping.entity_endpoint`, shared by every client
+# of the backend across threads and asyncio tasks. No endpoint is limited
+# until configured, e.g. `rate_limiter.configure("/vendors", rate=5, burst=10)`
+# to match the remote system's limits.
+rate_limiter = lib.RateLimiter()
+
 
 mapping = lib.Mapping(
     local_remote_entity={
@@ -39,15 +56,35 @@ mapping = lib.Mapping(
 )
 
 
+# Clients hold no state besides their endpoint and the shared rate limiter,
+# so one is kept per entity.
+@functools.lru_cache(maxsize=None)
 def generate_client(entity_class: typing.Type[lib.SyncEntity]):
-    # TODO(nav): Remove local import
-    from integration.backends.tally.client import Client
+    return client.Client(
+        endpoint=mapping.entity_endpoint[entity_class],
+        rate_limiter=rate_limiter,
+    )
+
 
-    return Client(
+@functools.lru_cache(maxsize=None)
+def generate_async_client(entity_class: typing.Type[lib.SyncEntity]):
+    return client.AsyncClient(
         endpoint=mapping.entity_endpoint[entity_class],
+        latency=LATENCY,
+        rate_limiter=rate_limiter,
     )
 
 
+def partition_key(entity) -> typing.Any:
+    """Bills of the same vendor share most of their dependencies, so they are
+    planned together by `services.sync_many`."""
+
+    vendor = getattr(entity, "vendor", None)
+    if vendor is not None:
+        return (type(vendor), vendor.id)
+    return (type(entity), entity.id)
+
+
 def sync(entity: lib.SyncEntity, force=False) -> lib.SyncResult:
     """
     Q: What does it mean for an object to be synced?
@@ -69,8 +106,89 @@ def sync(entity: lib.SyncEntity, force=False) -> lib.SyncResult:
             )
         else:
             object_map.remove(entity.local_id)
-            return sync(entity)
+            return sync(dataclasses.replace(entity, remote_id=None))
+
+    result, remote_id = _push(entity)
+    if remote_id is not None:
+        object_map.save({"local_id": entity.local_id, "remote_id": remote_id})
+    return result
+
+
+async def async_sync(entity: lib.SyncEntity, force=False) -> lib.SyncResult:
+    """Same as `sync`, for use from asyncio."""
+
+    entity_class = type(entity)
+    object_map = mapping.entity_datastore[entity_class]
+
+    if entity.remote_id is not None:
+        if not force:
+            return lib.SyncResult(
+                status=lib.SyncStatus.COMPLETED,
+                message="Object is already synced.",
+            )
+        object_map.remove(entity.local_id)
+        entity = dataclasses.replace(entity, remote_id=None)
+
+    result, remote_id = await _async_push(entity)
+    if remote_id is not None:
+        object_map.save({"local_id": entity.local_id, "remote_id": remote_id})
+    return result
+
+
+def sync_many(
+    entities: typing.Iterable[lib.SyncEntity], force=False
+) -> typing.List[lib.SyncResult]:
+    """
+    Sync several entities in the given order. New mappings are written with
+    a single bulk save per ObjectMap once every entity has been pushed.
+    """
+
+    results = []
+    mappings: typing.Dict[lib.Datastore, typing.List[dict]] = {}
+    try:
+        for entity in entities:
+            entity_class = type(entity)
+            if entity.remote_id is not None and not force:
+                results.append(
+                    lib.SyncResult(
+                        status=lib.SyncStatus.COMPLETED,
+                        message="Object is already synced.",
+                    )
+                )
+                continue
 
+            result, remote_id = _push(entity)
+            results.append(result)
+            if remote_id is not None:
+                mappings.setdefault(mapping.entity_datastore[entity_class], []).append(
+                    {"local_id": entity.local_id, "remote_id": remote_id}
+                )
+    except Exception:
+        # Remote records were already created for the entities pushed so far,
+        # so their mappings must be kept. A failure to do so must not mask
+        # the original error.
+        try:
+            _save_mappings(mappings)
+        except Exception:
+            logger.exception("Could not save object maps of a failed batch.")
+        raise
+    else:
+        _save_mappings(mappings)
+
+    return results
+
+
+def _save_mappings(mappings: typing.Dict[lib.Datastore, typing.List[dict]]):
+    for object_map, records in mappings.items():
+        object_map.save_many(records)
+
+
+def _push(
+    entity: lib.SyncEntity,
+) -> typing.Tuple[lib.SyncResult, typing.Optional[str]]:
+    """Create or look up the entity in the remote system."""
+
+    entity_class = type(entity)
     remote_client = generate_client(entity_class)
 
     # Special handling for readonly entities. We can't just push them to the
@@ -78,23 +196,51 @@ def sync(entity: lib.SyncEntity, force=False) -> lib.SyncResult:
     # the remote_id in the ObjectMap store.
     if entity_class in mapping.readonly_entity_lookup:
         lookup_key = mapping.readonly_entity_lookup[entity_class]
-
         response = remote_client.search(
             key=lookup_key, value=getattr(entity, lookup_key)
         )
-        if response.status != 200:
-            return lib.SyncResult(status=lib.SyncStatus.ERROR, message=response.body)
-        remote_id = response.body["id"]
     else:
         response = remote_client.send(entity.serialize())
-        if response.status != 200:
-            return lib.SyncResult(status=lib.SyncStatus.ERROR, message=response.body)
-        remote_id = response.body
+    return _pushed(entity_class, response)
+
+
+async def _async_push(
+    entity: lib.SyncEntity,
+) -> typing.Tuple[lib.SyncResult, typing.Optional[str]]:
+    """Same as `_push`, without blocking the event loop on the request."""
+
+    entity_class = type(entity)
+    remote_client = generate_async_client(entity_class)
+
+    if entity_class in mapping.readonly_entity_lookup:
+        lookup_key = mapping.readonly_entity_lookup[entity_class]
+        response = await remote_client.search(
+            key=lookup_key, value=getattr(entity, lookup_key)
+        )
+    else:
+        response = await remote_client.send(entity.serialize())
+    return _pushed(entity_class, response)
 
-    local_id = entity.local_id
 
-    object_map.save({"local_id": local_id, "remote_id": remote_id})
-    return lib.SyncResult(
-        status=lib.SyncStatus.COMPLETED,
-        message="Entity synced successfully.",
+def _pushed(
+    entity_class: typing.Type[lib.SyncEntity], response: lib.Response
+) -> typing.Tuple[lib.SyncResult, typing.Optional[str]]:
+    if response.status != 200:
+        return (
+            lib.SyncResult(status=lib.SyncStatus.ERROR, message=response.body),
+            None,
+        )
+
+    # Lookups return the remote record, while creating one returns its id.
+    if entity_class in mapping.readonly_entity_lookup:
+        remote_id = response.body["id"]
+    else:
+        remote_id = response.body
+
+    return (
+        lib.SyncResult(
+            status=lib.SyncStatus.COMPLETED,
+            message="Entity synced successfully.",
+        ),
+        remote_id,
     )
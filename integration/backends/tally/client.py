@@ -1,28 +1,125 @@
 #!/usr/bin/env python3
+import time
+import typing
+import asyncio
+from urllib import parse
 from integration import lib
 from integration.backends.tally import server
 
 
+def _list_route(endpoint: str, limit=None, after=None) -> str:
+    params = {}
+    if limit is not None:
+        params["limit"] = limit
+    if after is not None:
+        params["after"] = after
+    return f"{endpoint}/?{parse.urlencode(params)}"
+
+
+# Seconds to wait before retrying a throttled request that did not say when to
+# retry. It doubles with every attempt.
+BACKOFF = 0.1
+
+
+def _retry_after(response: lib.Response, attempt: int) -> typing.Optional[float]:
+    """Seconds to wait before retrying the request, or None if it should not
+    be retried."""
+
+    if response.status != 429:
+        return None
+    if isinstance(response.body, dict) and "retry_after" in response.body:
+        return response.body["retry_after"]
+    return BACKOFF * 2**attempt
+
+
 class Client(lib.Client):
-    def send(self, body) -> lib.Response:
-        status, _body = server.handle_request(
-            method="POST",
-            route=self.endpoint,
-            body=body,
-        )
-        response = lib.Response(status=status, body=_body)
+    """
+    Requests wait for their turn with ``rate_limiter``, and throttled requests
+    are retried up to ``max_retries`` times.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        rate_limiter: typing.Optional[lib.RateLimiter] = None,
+        max_retries: int = 3,
+    ):
+        super().__init__(endpoint)
+        self.rate_limiter = rate_limiter or lib.RateLimiter()
+        self.max_retries = max_retries
+
+    def _request(self, method: str, route: str, body=None) -> lib.Response:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(self.endpoint)
+            status, _body = server.handle_request(method=method, route=route, body=body)
+            response = lib.Response(status=status, body=_body)
+
+            wait = _retry_after(response, attempt)
+            if wait is None or attempt == self.max_retries:
+                break
+            # Hold back every request to the endpoint, not just this one.
+            self.rate_limiter.pause(self.endpoint, wait)
+            time.sleep(wait)
         return response
 
+    def send(self, body) -> lib.Response:
+        return self._request("POST", self.endpoint, body)
+
     def retrieve(self, key) -> lib.Response:
-        status, body = server.handle_request(
-            method="GET", route=f"{self.endpoint}/{key}"
-        )
-        response = lib.Response(status=status, body=body)
-        return response
+        return self._request("GET", f"{self.endpoint}/{key}")
 
     def search(self, key: str, value: str) -> lib.Response:
-        status, body = server.handle_request(
-            method="GET", route=f"{self.endpoint}/?{key}={value}"
-        )
-        response = lib.Response(status=status, body=body)
+        return self._request("GET", f"{self.endpoint}/?{key}={value}")
+
+    def list(self, limit=None, after=None) -> lib.Response:
+        return self._request("GET", _list_route(self.endpoint, limit, after))
+
+
+class AsyncClient(lib.AsyncClient):
+    """
+    Client for use from asyncio. Every request waits for ``latency`` seconds
+    before reaching the server, to simulate a round trip over the network
+    without blocking the event loop. Rate limiting and retries are the same as
+    for `Client`.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        latency: float = 0.0,
+        rate_limiter: typing.Optional[lib.RateLimiter] = None,
+        max_retries: int = 3,
+    ):
+        super().__init__(endpoint)
+        self.latency = latency
+        self.rate_limiter = rate_limiter or lib.RateLimiter()
+        self.max_retries = max_retries
+
+    async def _request(self, method: str, route: str, body=None) -> lib.Response:
+        for attempt in range(self.max_retries + 1):
+            wait = self.rate_limiter.reserve(self.endpoint)
+            if wait:
+                await asyncio.sleep(wait)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            status, _body = server.handle_request(method=method, route=route, body=body)
+            response = lib.Response(status=status, body=_body)
+
+            wait = _retry_after(response, attempt)
+            if wait is None or attempt == self.max_retries:
+                break
+            self.rate_limiter.pause(self.endpoint, wait)
+            await asyncio.sleep(wait)
         return response
+
+    async def send(self, body) -> lib.Response:
+        return await self._request("POST", self.endpoint, body)
+
+    async def retrieve(self, key) -> lib.Response:
+        return await self._request("GET", f"{self.endpoint}/{key}")
+
+    async def search(self, key: str, value: str) -> lib.Response:
+        return await self._request("GET", f"{self.endpoint}/?{key}={value}")
+
+    async def list(self, limit=None, after=None) -> lib.Response:
+        return await self._request("GET", _list_route(self.endpoint, limit, after))
@@ -3,6 +3,7 @@
 import pytest
 from . import server
 from . import database
+from . import rate_limiter
 
 
 @pytest.fixture(autouse=True)
@@ -22,6 +23,13 @@ def reset_datastores():
     database.VendorBillObjectMap.reset()
 
 
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    yield
+    server.rate_limits.clear()
+    rate_limiter.clear()
+
+
 @pytest.fixture
 def currencies_datastore():
     _currencies = [
@@ -1,10 +1,30 @@
 #!/usr/bin/env python3
 
-import string
+import os
 from integration import lib
+from integration import storage
 
 # This is a simulation of ObjectMap per integration backend.
 
+# When set, object maps are persisted under this directory and survive
+# process restarts. Otherwise they only live in memory.
+STORAGE_DIR = os.environ.get("TALLY_OBJECTMAP_DIR")
+
+# When set, mappings are held in compact arrays rather than a dict per record.
+# This trades slower lookups for a fraction of the memory.
+COMPACT = bool(int(os.environ.get("TALLY_OBJECTMAP_COMPACT", 0)))
+
+
+def _storage(filename: str):
+    table = storage.ObjectMapStorage() if COMPACT else None
+    if not STORAGE_DIR:
+        return table
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    return storage.LogStorage(
+        os.path.join(STORAGE_DIR, f"{filename}.log"), table=table
+    )
+
+
 CurrencyObjectMap = lib.Datastore(
     name="Currency",
     fields=(
@@ -12,7 +32,8 @@ CurrencyObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("currency"),
 )
 
 LocationObjectMap = lib.Datastore(
@@ -22,7 +43,8 @@ LocationObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("location"),
 )
 
 DepartmentObjectMap = lib.Datastore(
@@ -32,7 +54,8 @@ DepartmentObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("department"),
 )
 
 AccountCodeObjectMap = lib.Datastore(
@@ -42,7 +65,8 @@ AccountCodeObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("account_code"),
 )
 
 AccountObjectMap = lib.Datastore(
@@ -52,7 +76,8 @@ AccountObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("account"),
 )
 
 VendorObjectMap = lib.Datastore(
@@ -62,7 +87,8 @@ VendorObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("vendor"),
 )
 
 VendorBillObjectMap = lib.Datastore(
@@ -72,5 +98,6 @@ VendorBillObjectMap = lib.Datastore(
         "remote_id",
     ),
     pk="local_id",
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    storage=_storage("vendor_bill"),
 )
@@ -1,110 +1,183 @@
 #!/usr/bin/env python3
 import typing
+import contextlib
+import contextvars
 import dataclasses
 
 from integration import lib
 from integration.backends.tally import database
 
+ObjectMapKey = typing.Tuple[lib.Datastore, typing.Any]
+
+# Object map records fetched ahead of a batch conversion, keyed by object map
+# and then local id. Keys that were fetched but have no mapping hold None.
+_prefetched: contextvars.ContextVar[
+    typing.Optional[typing.Dict[lib.Datastore, typing.Dict[typing.Any, dict]]]
+] = contextvars.ContextVar("prefetched", default=None)
+
+
+@contextlib.contextmanager
+def prefetch(keys: typing.Iterable[ObjectMapKey]) -> typing.Iterator[None]:
+    """Fetch the given object map records with one bulk lookup per object map,
+    for `from_local` calls within the block to use."""
+
+    grouped: typing.Dict[lib.Datastore, set] = {}
+    for object_map, key in keys:
+        grouped.setdefault(object_map, set()).add(key)
+
+    view = {}
+    for object_map, local_ids in grouped.items():
+        found = object_map.retrieve_many(local_ids)
+        view[object_map] = {key: found.get(key) for key in local_ids}
+
+    token = _prefetched.set(view)
+    try:
+        yield
+    finally:
+        _prefetched.reset(token)
+
+
+def _remote_id(object_map: lib.Datastore, local_id) -> typing.Optional[str]:
+    records = _prefetched.get()
+    if records is not None and local_id in records.get(object_map, ()):
+        record = records[object_map][local_id]
+    else:
+        record = object_map.retrieve(local_id)
+    return record.get("remote_id") if record is not None else None
+
+
+class TallyEntity(lib.SyncEntity):
+    @classmethod
+    def object_map_keys(cls, orm) -> typing.Iterator[ObjectMapKey]:
+        """Yield the object map records that `from_local` looks up for the
+        given local entity, including those of its dependencies."""
+        return iter(())
+
+    @classmethod
+    def from_local_many(cls, orms: typing.Iterable) -> typing.List["TallyEntity"]:
+        """Convert several local entities, fetching every object map record
+        they need up front rather than one at a time."""
+
+        orms = list(orms)
+        keys = (key for orm in orms for key in cls.object_map_keys(orm))
+        with prefetch(keys):
+            return [cls.from_local(orm) for orm in orms]
+
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class Currency(lib.SyncEntity):
+class Currency(TallyEntity):
     name: str
     iso_code: str
 
     @classmethod
+    def object_map_keys(cls, orm):
+        yield (database.CurrencyObjectMap, orm.id)
+
+    @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
-        object_map = database.CurrencyObjectMap.retrieve(orm.id)
         return cls(
             local_id=orm.id,
-            remote_id=object_map.get("remote_id") if object_map is not None else None,
+            remote_id=_remote_id(database.CurrencyObjectMap, orm.id),
             name=orm.name,
             iso_code=orm.name,
         )
 
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class Location(lib.SyncEntity):
+class Location(TallyEntity):
     name: str
 
     @classmethod
+    def object_map_keys(cls, orm):
+        yield (database.LocationObjectMap, orm.id)
+
+    @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
-        object_map = database.LocationObjectMap.retrieve(orm.id)
         return cls(
             local_id=orm.id,
-            remote_id=object_map.get("remote_id") if object_map is not None else None,
+            remote_id=_remote_id(database.LocationObjectMap, orm.id),
             name=orm.name,
         )
 
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class Department(lib.SyncEntity):
+class Department(TallyEntity):
     name: str
 
     @classmethod
+    def object_map_keys(cls, orm):
+        yield (database.DepartmentObjectMap, orm.id)
+
+    @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
-        object_map = database.DepartmentObjectMap.retrieve(orm.id)
         return cls(
             local_id=orm.id,
-            remote_id=object_map.get("remote_id") if object_map is not None else None,
+            remote_id=_remote_id(database.DepartmentObjectMap, orm.id),
             name=orm.name,
         )
 
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class ChartOfAccounts(lib.SyncEntity):
+class ChartOfAccounts(TallyEntity):
     number: str
     name: str
 
     @classmethod
+    def object_map_keys(cls, orm):
+        yield (database.AccountCodeObjectMap, orm.account_code.id)
+
+    @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
         # Just for fun, we'll be passing an Account instance instead of
         # AccountCode. Account is more commonly used in the codebase than
         # AccountCode.
-        object_map = database.AccountCodeObjectMap.retrieve(orm.account_code.id)
         return cls(
             local_id=orm.id,
-            remote_id=object_map.get("remote_id") if object_map is not None else None,
+            remote_id=_remote_id(database.AccountCodeObjectMap, orm.account_code.id),
             number=orm.account_code.code,
             name=orm.account_code.description,
         )
 
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class Vendor(lib.SyncEntity):
+class Vendor(TallyEntity):
     name: str
     location: Location
 
-    def serialize(self):
-        ser = super().serialize()
-        ser["location_id"] = self.location.remote_id
-        return ser
+    @classmethod
+    def object_map_keys(cls, orm):
+        yield (database.VendorObjectMap, orm.id)
+        yield from Location.object_map_keys(orm.location)
 
     @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
-        object_map = database.VendorObjectMap.retrieve(orm.id)
         return cls(
             local_id=orm.id,
-            remote_id=object_map.get("remote_id") if object_map is not None else None,
+            remote_id=_remote_id(database.VendorObjectMap, orm.id),
             name=orm.name,
             location=Location.from_local(orm.location),
         )
 
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class Item(lib.SyncEntity):
+class Item(TallyEntity):
     description: str
     quantity: int
     rate: int
     total: int
     currency: Currency
 
-    def serialize(self):
-        ser = super().serialize()
-        print(self.currency)
-        ser["currency_id"] = self.currency.remote_id
-        return ser
+    @classmethod
+    def object_map_keys(cls, orm):
+        yield from Currency.object_map_keys(orm.currency)
 
     @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
         # There will instances where remote system requires a certain attribute
         # that does not exist locally. In those case, we either need to define
@@ -121,7 +194,7 @@ class Item(lib.SyncEntity):
 
 
 @dataclasses.dataclass(eq=False, frozen=True)
-class VendorBill(lib.SyncEntity):
+class VendorBill(TallyEntity):
     invoice: str
     account: ChartOfAccounts
     vendor: Vendor
@@ -130,26 +203,24 @@ class VendorBill(lib.SyncEntity):
     department: Department
     items: typing.List[Item]
 
-    def serialize(self):
-        ser = super().serialize()
-        ser.update(
-            {
-                "account_id": self.account.remote_id,
-                "vendor_id": self.vendor.remote_id,
-                "currency_id": self.currency.remote_id,
-                "location_id": self.location.remote_id,
-                "department_id": self.department.remote_id,
-                "items": [item.serialize() for item in self.items],
-            }
-        )
-        return ser
+    @classmethod
+    def object_map_keys(cls, orm):
+        department = orm.items[0].account.department
+        yield (database.VendorBillObjectMap, orm.id)
+        yield from ChartOfAccounts.object_map_keys(orm.items[0].account)
+        yield from Vendor.object_map_keys(orm.vendor)
+        yield from Currency.object_map_keys(orm.currency)
+        yield from Location.object_map_keys(department.branch)
+        yield from Department.object_map_keys(department)
+        for item in orm.items:
+            yield from Item.object_map_keys(item)
 
     @classmethod
+    @lib.memoize_from_local
     def from_local(cls, orm):
-        object_map = database.VendorBillObjectMap.retrieve(orm.id)
         return cls(
             local_id=orm.id,
-            remote_id=object_map.get("remote_id") if object_map is not None else None,
+            remote_id=_remote_id(database.VendorBillObjectMap, orm.id),
             invoice=orm.invoice_number,
             account=ChartOfAccounts.from_local(orm.items[0].account),
             vendor=Vendor.from_local(orm.vendor),
@@ -9,7 +9,7 @@ from urllib import parse
 from integration import lib
 
 
-__all__ = ["handle_request"]
+__all__ = ["handle_request", "set_rate_limit"]
 
 
 ############
@@ -24,6 +24,8 @@ CurrencyStore = lib.Datastore(
         "name",
         "iso_code",
     ),
+    indexes=("name",),
+    unique_indexes=("iso_code",),
 )
 
 LocationStore = lib.Datastore(
@@ -32,6 +34,7 @@ LocationStore = lib.Datastore(
         "id",
         "name",
     ),
+    indexes=("name",),
 )
 
 DepartmentStore = lib.Datastore(
@@ -40,6 +43,7 @@ DepartmentStore = lib.Datastore(
         "id",
         "name",
     ),
+    indexes=("name",),
 )
 
 ChartOfAccountsStore = lib.Datastore(
@@ -49,6 +53,7 @@ ChartOfAccountsStore = lib.Datastore(
         "number",
         "name",
     ),
+    indexes=("number",),
 )
 
 VendorStore = lib.Datastore(
@@ -82,6 +87,11 @@ class MethodNotSupportedError(Exception):
     pass
 
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+PAGINATION_PARAMS = {"limit", "after"}
+
+
 class API:
     store: lib.Datastore
 
@@ -102,14 +112,25 @@ class API:
                 return (404, {"error": str(e)})
             return (200, record)
         else:
-            # Search by key/value pair
-            records = self.store.retrieve()
-            for record in records:
-                if record.get(key, None) == value:
-                    return (200, record)
+            # Search by key/value pair. Indexed fields are resolved without
+            # scanning the whole datastore.
+            records = self.store.find(key, value)
+            if records:
+                return (200, records[0])
 
         return (404, {"error": f"Could not find entity with '{key}={value}'"})
 
+    def list(self, limit: int, after: typing.Optional[str] = None):
+        """Fetch a page of records ordered by key.
+
+        Args:
+            limit: Maximum number of records to return.
+            after: Cursor returned by the previous page.
+
+        """
+        records, cursor = self.store.page(limit=limit, after_key=after)
+        return (200, {"results": records, "next": cursor})
+
     def post(self, body: dict):
         try:
             record = self.store.save(body)
@@ -200,6 +221,38 @@ router.register(r"/vendorbills$", VendorBillAPI)
 router.register(r"/vendorbills/(\w+)?", VendorBillAPI)
 
 
+#################
+# Rate Limiting #
+#################
+
+
+# Buckets of the endpoints the server limits, keyed by the first segment of
+# the route such as "/vendors". Requests over the limit get a 429 response.
+rate_limits: typing.Dict[str, lib.TokenBucket] = {}
+
+
+def set_rate_limit(endpoint: str, rate: typing.Optional[float], burst: int = 1):
+    """Limit the endpoint to ``rate`` requests per second, or lift its limit if
+    ``rate`` is None."""
+
+    if rate is None:
+        rate_limits.pop(endpoint, None)
+    else:
+        rate_limits[endpoint] = lib.TokenBucket(rate, burst)
+
+
+def _throttle(route: str) -> typing.Optional[typing.Tuple[int, dict]]:
+    endpoint = "/" + parse.urlparse(route).path.split("/")[1]
+    bucket = rate_limits.get(endpoint)
+    if bucket is None:
+        return None
+
+    retry_after = bucket.try_acquire()
+    if retry_after:
+        return (429, {"error": "Too many requests.", "retry_after": retry_after})
+    return None
+
+
 #######################
 # HTTP Call Simulator #
 #######################
@@ -210,6 +263,10 @@ def handle_request(
 ) -> typing.Tuple[int, dict]:
     method_enum = RequestMethod(method.lower())
 
+    throttled = _throttle(route)
+    if throttled is not None:
+        return throttled
+
     if body is None:
         body = {}
 
@@ -231,9 +288,15 @@ def handle_request(
             key = api.store.pk
             value = params[0]
         else:
-            # Convert ?foo=bar to key=foo, value=bar
-            qs = parse.urlparse(route).query
-            key, value = parse.parse_qsl(qs)[0]
+            qs = parse.parse_qsl(parse.urlparse(route).query)
+            search = [(k, v) for k, v in qs if k not in PAGINATION_PARAMS]
+            if not search:
+                # No search criteria, so list records a page at a time.
+                return _list(api, dict(qs))
+
+            # Convert ?foo=bar to key=foo, value=bar. A search returns a single
+            # record, so pagination params alongside it are ignored.
+            key, value = search[0]
 
         return api_method(key=key, value=value)
 
@@ -241,3 +304,14 @@ def handle_request(
         return api_method(body)
 
     raise ValueError("Invalid Request")
+
+
+def _list(api: API, params: typing.Dict[str, str]) -> typing.Tuple[int, dict]:
+    try:
+        limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return (400, {"error": "Query parameter 'limit' must be an integer."})
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        return (400, {"error": f"Query parameter 'limit' must be 1-{MAX_PAGE_SIZE}."})
+
+    return api.list(limit=limit, after=params.get("after"))
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
+import pytest
 import random
-from . import generate_client, sync
+import asyncio
+from integration import lib
+from . import generate_client, sync, sync_many
 from . import entities
 from . import database
 from . import server
+from .client import Client, AsyncClient
 
 
 class TestClient:
@@ -34,6 +38,57 @@ class TestClient:
         assert isinstance(response.body, dict)
         assert response.body["name"] == "Toronto"
 
+    def test_can_list(self, locations_datastore):
+        _client = generate_client(entity_class=entities.Location)
+        response = _client.list(limit=1)
+        assert response.status == 200
+        assert len(response.body["results"]) == 1
+
+        response = _client.list(after=response.body["next"])
+        assert response.status == 200
+        assert len(response.body["results"]) == 1
+        assert response.body["next"] is None
+
+    def test_async_client(self, locations_datastore):
+        _client = AsyncClient(endpoint="/locations", latency=0.001)
+        response = asyncio.run(_client.search(key="name", value="Toronto"))
+        assert response.status == 200
+        assert response.body["name"] == "Toronto"
+
+        response = asyncio.run(_client.list(limit=1))
+        assert len(response.body["results"]) == 1
+
+    def test_retries_throttled_requests(self, locations_datastore):
+        server.set_rate_limit("/locations", rate=50)
+        _client = Client(endpoint="/locations")
+
+        responses = [_client.search(key="name", value="Toronto") for _ in range(3)]
+        assert [r.status for r in responses] == [200] * 3
+
+        _client = Client(endpoint="/locations", max_retries=0)
+        response = _client.search(key="name", value="Toronto")
+        assert response.status == 429
+
+    def test_rate_limiter_keeps_requests_under_limit(self, locations_datastore):
+        server.set_rate_limit("/locations", rate=50, burst=5)
+        limiter = lib.RateLimiter({"/locations": (50, 5)})
+        _client = Client(endpoint="/locations", rate_limiter=limiter, max_retries=0)
+
+        responses = [_client.search(key="name", value="Toronto") for _ in range(10)]
+        assert [r.status for r in responses] == [200] * 10
+
+    def test_async_client_retries_throttled_requests(self, locations_datastore):
+        server.set_rate_limit("/locations", rate=50)
+        _client = AsyncClient(endpoint="/locations")
+
+        async def search():
+            return await asyncio.gather(
+                *(_client.search(key="name", value="Toronto") for _ in range(3))
+            )
+
+        responses = asyncio.run(search())
+        assert [r.status for r in responses] == [200] * 3
+
 
 class TestSync:
     def test_can_sync_readonly_entities(self, currencies_datastore):
@@ -86,3 +141,46 @@ class TestSync:
         remote_vendor = server.VendorStore.retrieve()[0]
 
         assert local_vendor["remote_id"] == remote_vendor["id"]
+
+    def test_can_sync_many(self, currencies_datastore, locations_datastore):
+        currencies = [
+            entities.Currency(local_id=i, remote_id=None, name=code, iso_code=code)
+            for i, code in enumerate(["CAD", "USD", "GBP"], start=1)
+        ]
+        location = entities.Location(local_id=1, remote_id=None, name="Toronto")
+        synced = entities.Location(local_id=2, remote_id="abc", name="Vancouver")
+
+        results = sync_many([*currencies, location, synced])
+
+        assert [r.status for r in results[:-1]] == [lib.SyncStatus.COMPLETED] * 4
+        assert results[-1].message == "Object is already synced."
+        assert len(database.CurrencyObjectMap.retrieve()) == 3
+        assert database.LocationObjectMap.retrieve(1)["remote_id"] == (
+            locations_datastore[1]
+        )
+        assert database.LocationObjectMap.retrieve(2) is None
+
+    def test_sync_many_keeps_mappings_on_failure(
+        self, monkeypatch, currencies_datastore
+    ):
+        from integration.backends import tally
+
+        currencies = [
+            entities.Currency(local_id=i, remote_id=None, name=code, iso_code=code)
+            for i, code in enumerate(["CAD", "USD"], start=1)
+        ]
+        push = tally._push
+
+        def failing_push(entity):
+            if entity.local_id == 2:
+                raise RuntimeError("Connection reset")
+            return push(entity)
+
+        monkeypatch.setattr(tally, "_push", failing_push)
+        with pytest.raises(RuntimeError, match="Connection reset"):
+            sync_many(currencies)
+
+        assert database.CurrencyObjectMap.retrieve(1)["remote_id"] == (
+            currencies_datastore[0]
+        )
+        assert database.CurrencyObjectMap.retrieve(2) is None
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
+from integration import lib
 from integration import graph
 from integration.backends.tally import entities
+from integration.backends.tally import database
 
 
 class TestEntity:
@@ -20,6 +22,49 @@ class TestEntity:
         assert serialized["local_id"] == bill.id
         assert serialized["remote_id"] is None
 
+        # Nested entities are sent as their remote ids.
+        assert set(serialized) == {
+            "local_id",
+            "remote_id",
+            "invoice",
+            "account_id",
+            "vendor_id",
+            "currency_id",
+            "location_id",
+            "department_id",
+            "items",
+        }
+        assert len(serialized["items"]) == len(bill.items)
+        assert "currency_id" in serialized["items"][0]
+        assert "currency" not in serialized["items"][0]
+
+    def test_can_convert_many(self, monkeypatch, bill):
+        database.CurrencyObjectMap.save(
+            {"local_id": bill.currency.id, "remote_id": "c"}
+        )
+        expected = entities.VendorBill.from_local(bill)
+
+        def retrieve(self, key=None, raise_exception=False):
+            raise AssertionError("Object maps must not be read one at a time.")
+
+        monkeypatch.setattr(lib.Datastore, "retrieve", retrieve)
+        (vendor_bill,) = entities.VendorBill.from_local_many([bill])
+
+        assert vendor_bill == expected
+        assert vendor_bill.currency.remote_id == "c"
+        assert vendor_bill.items[0].currency.remote_id == "c"
+        assert vendor_bill.vendor.remote_id is None
+
+    def test_shared_entities_are_built_once(self, bill):
+        with lib.interning():
+            first = entities.VendorBill.from_local(bill)
+            second = entities.VendorBill.from_local(bill)
+        assert first is second
+        for item in first.items:
+            assert item.currency is first.currency
+
+        assert entities.VendorBill.from_local(bill) is not first
+
 
 class TestGraph:
     def test_can_generate_graph(self, bill):
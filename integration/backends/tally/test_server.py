@@ -28,3 +28,49 @@ class TestAPI:
         status, body = server.handle_request("GET", f"/currencies/?{key}={value}")
         assert status == 200
         assert body[key] == value, body
+
+    def test_search_ignores_pagination_params(self, currencies_datastore):
+        status, body = server.handle_request(
+            "GET", "/currencies/?limit=5&iso_code=GBP"
+        )
+        assert status == 200
+        assert body["iso_code"] == "GBP", body
+
+    def test_can_list_records(self, currencies_datastore):
+        status, body = server.handle_request("GET", "/currencies/?limit=2")
+        assert status == 200
+        assert len(body["results"]) == 2
+        assert body["next"] == body["results"][-1]["id"]
+
+        status, body = server.handle_request(
+            "GET", f"/currencies/?limit=2&after={body['next']}"
+        )
+        assert status == 200
+        assert len(body["results"]) == 1
+        assert body["next"] is None
+
+        status, body = server.handle_request("GET", "/currencies/")
+        assert sorted(r["id"] for r in body["results"]) == sorted(currencies_datastore)
+
+    def test_rejects_invalid_page_size(self, currencies_datastore):
+        status, body = server.handle_request("GET", "/currencies/?limit=abc")
+        assert status == 400
+        status, body = server.handle_request("GET", "/currencies/?limit=0")
+        assert status == 400
+
+    def test_throttles_over_rate_limit(self, currencies_datastore):
+        server.set_rate_limit("/currencies", rate=1, burst=2)
+
+        statuses = [
+            server.handle_request("GET", "/currencies/?iso_code=CAD")[0]
+            for _ in range(3)
+        ]
+        assert statuses == [200, 200, 429]
+        currency_id = currencies_datastore[0]
+        status, body = server.handle_request("GET", f"/currencies/{currency_id}")
+        assert status == 429
+        assert 0 < body["retry_after"] <= 1
+
+        # Other endpoints are not limited.
+        status, _ = server.handle_request("GET", "/locations/?limit=1")
+        assert status == 200
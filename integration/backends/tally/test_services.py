@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import pytest
+import asyncio
+import functools
+import multiprocessing
+from concurrent import futures
+from integration import lib
+from integration import entities
+from integration import services
+from . import server
+from .client import AsyncClient
+from . import database
+
+
+@pytest.fixture
+def local_vendor(locations_datastore):
+    currency = entities.Currency(id=1, name="CAD", rate=1)
+    location = entities.Location(id=1, name="Vancouver", localCurrency=currency)
+    return entities.Vendor(id=1, name="Staples", currency=currency, location=location)
+
+
+class TestSync:
+    @pytest.mark.parametrize("max_workers", [1, 4])
+    def test_can_sync(self, local_vendor, max_workers):
+        results = list(services.sync(local_vendor, "tally", max_workers=max_workers))
+
+        statuses = [result.status for result in results]
+        assert statuses.count(lib.SyncStatus.COMPLETED) == 2, results
+        assert lib.SyncStatus.ERROR not in statuses
+        # Location is a dependency of vendor, so it is synced first.
+        assert "Location" in results[0].message
+        assert database.LocationObjectMap.retrieve(1) is not None
+        assert database.VendorObjectMap.retrieve(1) is not None
+        assert len(server.VendorStore) == 1
+
+    def test_skips_synced_dependencies(self, local_vendor):
+        list(services.sync(local_vendor, "tally"))
+
+        results = list(services.sync(local_vendor, "tally"))
+        assert len(results) == 3
+        assert results[-1].message == "Object is already synced."
+
+        results = list(services.sync(local_vendor, "tally", force=True))
+        assert [r.message for r in results if r.status == lib.SyncStatus.COMPLETED] == [
+            "Entity synced successfully.",
+            "Entity synced successfully.",
+        ]
+        assert len(server.VendorStore) == 2
+
+
+class TestSyncMany:
+    def test_can_sync_many(self, local_vendor):
+        other = entities.Vendor(
+            id=2,
+            name="Juice Bar",
+            currency=local_vendor.currency,
+            location=local_vendor.location,
+        )
+
+        synced = []
+        summary = services.sync_many(
+            [local_vendor, other],
+            "tally",
+            on_result=lambda entity, result: synced.append((entity, result)),
+        )
+
+        # The shared location is only synced once, before both vendors.
+        assert [type(entity).__name__ for entity, _ in synced] == [
+            "Location",
+            "Vendor",
+            "Vendor",
+        ]
+        assert summary.roots == 2 and summary.entities == 3
+        assert summary.statuses == {lib.SyncStatus.COMPLETED: 3}
+        assert set(summary.timings) == {"convert", "plan", "sync"}
+        assert len(server.VendorStore) == 2
+        assert len(database.VendorObjectMap) == 2
+
+        summary = services.sync_many([local_vendor, other], "tally")
+        assert summary.entities == 2
+        assert len(server.VendorStore) == 2
+
+    def test_can_plan_in_processes(self, local_vendor):
+        others = [
+            entities.Vendor(
+                id=i,
+                name=f"Vendor {i}",
+                currency=local_vendor.currency,
+                location=local_vendor.location,
+            )
+            for i in range(2, 5)
+        ]
+
+        synced = []
+        summary = services.sync_many(
+            [local_vendor, *others],
+            "tally",
+            on_result=lambda entity, result: synced.append(entity),
+            processes=2,
+        )
+
+        # Every partition planned the shared location, but it is synced once.
+        assert [type(entity).__name__ for entity in synced] == ["Location"] + [
+            "Vendor"
+        ] * 4
+        assert summary.statuses == {lib.SyncStatus.COMPLETED: 5}
+        assert len(server.VendorStore) == 4
+        assert len(database.VendorObjectMap) == 4
+
+    def test_workers_without_object_maps_do_not_recreate(
+        self, monkeypatch, local_vendor
+    ):
+        others = [
+            entities.Vendor(
+                id=i,
+                name=f"Vendor {i}",
+                currency=local_vendor.currency,
+                location=local_vendor.location,
+            )
+            for i in range(2, 5)
+        ]
+        services.sync_many([local_vendor, *others], "tally")
+        assert len(server.VendorStore) == 4
+
+        # Spawned workers start with empty object maps.
+        monkeypatch.setattr(
+            services.futures,
+            "ProcessPoolExecutor",
+            functools.partial(
+                futures.ProcessPoolExecutor,
+                mp_context=multiprocessing.get_context("spawn"),
+            ),
+        )
+        summary = services.sync_many([local_vendor, *others], "tally", processes=2)
+
+        assert summary.statuses == {lib.SyncStatus.COMPLETED: 5}
+        assert len(server.VendorStore) == 4
+
+
+class TestAsyncSync:
+    def test_can_sync(self, local_vendor):
+        async def run():
+            return [r async for r in services.async_sync(local_vendor, "tally")]
+
+        results = asyncio.run(run())
+
+        statuses = [result.status for result in results]
+        assert statuses.count(lib.SyncStatus.COMPLETED) == 2, results
+        assert "Location" in results[0].message
+        assert database.VendorObjectMap.retrieve(1) is not None
+        assert len(server.VendorStore) == 1
+
+    def test_concurrency_is_bounded(self, monkeypatch, locations_datastore):
+        in_flight = []
+        request = AsyncClient._request
+
+        async def slow_request(self, *args, **kwargs):
+            in_flight.append(len(in_flight) + 1)
+            await asyncio.sleep(0.01)
+            try:
+                return await request(self, *args, **kwargs)
+            finally:
+                in_flight.pop()
+
+        monkeypatch.setattr(AsyncClient, "_request", slow_request)
+        currency = entities.Currency(id=1, name="CAD", rate=1)
+        location = entities.Location(id=1, name="Vancouver", localCurrency=currency)
+        vendors = [
+            entities.Vendor(id=i, name=f"v{i}", currency=currency, location=location)
+            for i in range(20)
+        ]
+
+        peak = []
+
+        async def run():
+            semaphore = asyncio.Semaphore(5)
+
+            async def sync(vendor):
+                async for _ in services.async_sync(
+                    vendor, "tally", semaphore=semaphore
+                ):
+                    peak.append(len(in_flight))
+
+            await asyncio.gather(*(sync(vendor) for vendor in vendors))
+
+        asyncio.run(run())
+        assert 1 < max(peak) <= 5
+        assert len(server.VendorStore) == 20
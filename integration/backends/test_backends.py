@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import pytest
+from integration import backends
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(backends, "_registry", dict(backends._registry))
+    monkeypatch.setattr(backends, "_loaded", {})
+
+
+class TestRegistry:
+    def test_backend_is_loaded_once(self, registry):
+        tally = backends.get_backend("tally")
+        assert tally.mapping and tally.sync
+        assert backends.get_backend("tally") is tally
+
+    def test_unknown_backend(self, registry):
+        with pytest.raises(backends.BackendError, match="does not exist"):
+            backends.get_backend("ledger")
+
+        backends.register_backend("ledger", "integration.backends.ledger")
+        with pytest.raises(backends.BackendError, match="does not exist"):
+            backends.get_backend("ledger")
+
+    def test_incomplete_backend(self, registry):
+        backends.register_backend("graph", "integration.graph")
+        with pytest.raises(backends.BackendError, match="does not define 'mapping'"):
+            backends.get_backend("graph")
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
-import string
 from integration import lib
 from integration import entities
 
-# This is a simulation of local database.
+# This is a simulation of local database. Every store records its changes so
+# that entities changed since the last sync can be found.
 
 CurrencyStore = lib.Datastore(
     name="Currency",
@@ -13,7 +13,8 @@ CurrencyStore = lib.Datastore(
         "name",
         "rate",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 LocationStore = lib.Datastore(
@@ -23,7 +24,8 @@ LocationStore = lib.Datastore(
         "name",
         "localCurrency_id",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 DepartmentStore = lib.Datastore(
@@ -33,7 +35,8 @@ DepartmentStore = lib.Datastore(
         "name",
         "branch_id",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 AccountCodeStore = lib.Datastore(
@@ -43,7 +46,8 @@ AccountCodeStore = lib.Datastore(
         "code",
         "description",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 AccountStore = lib.Datastore(
@@ -53,7 +57,8 @@ AccountStore = lib.Datastore(
         "number",
         "name",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 VendorStore = lib.Datastore(
@@ -63,7 +68,8 @@ VendorStore = lib.Datastore(
         "name",
         "currency_id",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 ItemStore = lib.Datastore(
@@ -75,7 +81,8 @@ ItemStore = lib.Datastore(
         "quantity",
         "unit_cost",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 BillStore = lib.Datastore(
@@ -87,7 +94,8 @@ BillStore = lib.Datastore(
         "currency_id",
         "items",
     ),
-    keyspace=string.digits,
+    key_allocator=lib.SequenceKeyAllocator(),
+    changefeed=lib.ChangeFeed(),
 )
 
 
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
+import array
 import typing
+import collections
 from integration import lib
 
+T = typing.TypeVar("T")
+
+# Number of dependencies a node scans before keeping a set of their identities.
+_SCAN_LIMIT = 8
+
 
 class Node:
+    __slots__ = ("entity", "deps", "is_visited", "_dep_keys")
+
     def __init__(
         self,
         entity: lib.SyncEntity,
@@ -12,13 +21,25 @@ class Node:
         self.entity = entity
         self.deps = deps if deps is not None else []
         self.is_visited = False
+        # Identities of the dependencies, so that adding one is O(1) no matter
+        # how many dependencies the node already has. Only kept once there
+        # are more than a few, since scanning those is cheaper than a set.
+        self._dep_keys: typing.Optional[set] = None
 
     def __repr__(self):
         return f"<Node {type(self.entity).__name__}={self.entity.local_id}>"
 
     def add_dependency(self, dep: "Node"):
-        if dep not in self.deps:
+        key = dep.entity.identity
+        keys = self._dep_keys
+        if keys is not None:
+            if key not in keys:
+                keys.add(key)
+                self.deps.append(dep)
+        elif all(node.entity.identity != key for node in self.deps):
             self.deps.append(dep)
+            if len(self.deps) > _SCAN_LIMIT:
+                self._dep_keys = {node.entity.identity for node in self.deps}
 
     def visit(self):
         if self.is_visited:
@@ -26,60 +47,278 @@ class Node:
         self.is_visited = True
 
 
-def generate_graph(root: lib.SyncEntity, cache=None):
+class CycleError(Exception):
+    """Raised when entities depend on each other in a cycle.
+
+    Attributes:
+        path: Entities forming the cycle, starting and ending with the same
+              entity.
+    """
+
+    def __init__(self, path: typing.List[lib.SyncEntity]):
+        self.path = path
+        cycle = " -> ".join(f"{type(e).__name__}({e.local_id})" for e in path)
+        super().__init__(f"Dependency cycle: {cycle}")
+
+
+def _dependencies(entity: lib.SyncEntity) -> typing.Iterator[lib.SyncEntity]:
+    for field_name, kind in lib.field_plan(type(entity)).dependencies:
+        value = getattr(entity, field_name)
+        if kind is lib.FieldKind.LIST:
+            yield from value
+        elif value is not None:
+            yield value
+
+
+def generate_graph(root: lib.SyncEntity, cache=None, force: bool = False):
+    """
+    Generate the dependency graph of the given entity and return its node.
+    The graph is built depth first with an explicit stack, so its depth is
+    not limited by the recursion limit.
+
+    Dependencies that already have a remote id are left out along with their
+    own dependencies, unless ``force`` is set. The root is always included.
+
+    Raises:
+        CycleError: An entity depends on itself, directly or not.
+    """
+
     if cache is None:
         cache = {}
 
-    if root in cache:
-        node = cache[root]
-    else:
-        node = Node(entity=root)
-        cache[node.entity] = node
-
-    for field_name, field in root.__dataclass_fields__.items():
-        if typing.get_origin(field.type) is list:
-            # Handle list of dependenecies
-            for item in getattr(root, field_name):
-                dep = generate_graph(item, cache)
-                node.add_dependency(dep)
-        elif typing.get_origin(field.type) is typing.Union:
-            # Handle optional dependency
-            item = getattr(root, field_name)
-            if item is not None:
-                dep = generate_graph(item, cache)
-                node.add_dependency(dep)
-        elif issubclass(field.type, lib.SyncEntity):
-            # Base case
-            dep = generate_graph(getattr(root, field_name), cache)
-            node.add_dependency(dep)
+    key = root.identity
+    if key in cache:
+        # Dependencies of this entity were already added when it was first
+        # reached through another path.
+        return cache[key]
+
+    node = cache[key] = Node(entity=root)
+
+    # Entities whose dependencies are still being added, in the order they
+    # were reached. Reaching one of them again means there is a cycle.
+    path = {key: root}
+    stack = [(node, _dependencies(root))]
+    while stack:
+        current, dependencies = stack[-1]
+        for entity in dependencies:
+            if entity.remote_id is not None and not force:
+                # Already synced, and so are its dependencies.
+                continue
+            key = entity.identity
+            dep = cache.get(key)
+            if dep is None:
+                dep = cache[key] = Node(entity=entity)
+                current.add_dependency(dep)
+                path[key] = entity
+                stack.append((dep, _dependencies(entity)))
+                break
+            if key in path:
+                entities = list(path.values())
+                start = list(path).index(key)
+                raise CycleError(entities[start:] + [entity])
+            current.add_dependency(dep)
+        else:
+            stack.pop()
+            path.popitem()
 
     return node
 
 
-def resolve_dependencies(node: Node):
+def generate_graph_many(
+    roots: typing.Iterable[lib.SyncEntity], force: bool = False
+) -> typing.List[Node]:
     """
-    Run depth first search on the given root of graph and produces a list
-    of entities in the order in which those should be synced.
+    Generate a single graph for several roots. Entities are deduplicated by
+    type and local id across every root, so a dependency shared by many roots
+    is only a single node. Returns the node of each root, in order.
     """
 
-    resolution = []
-    stack = [node]
+    cache: typing.Dict[typing.Tuple[type, typing.Any], Node] = {}
+    return [generate_graph(root, cache, force=force) for root in roots]
+
+
+def _resolve(nodes: typing.Sequence[Node]) -> typing.List[Node]:
+    """
+    Topologically sort the nodes reachable from the given roots of graph so
+    that every node comes after its dependencies.
+
+    This is Kahn's algorithm run from the root, whose output is then reversed,
+    so it takes O(V + E) time. Dependents are processed in the order their
+    dependencies were added, which keeps the resulting order deterministic.
+    """
+
+    # Count the number of dependents of every node reachable from the roots.
+    roots = list(dict.fromkeys(nodes))
+    in_degree = dict.fromkeys(roots, 0)
+    stack = list(roots)
     while stack:
-        current = stack.pop(0)
-        if current.deps:
-            for dep in current.deps:
-                if isinstance(dep, list):
-                    stack.extend(dep)
-                else:
-                    stack.append(dep)
+        current = stack.pop()
+        for dep in current.deps:
+            if dep in in_degree:
+                in_degree[dep] += 1
+            else:
+                in_degree[dep] = 1
+                stack.append(dep)
+
+    # A node is only emitted once all of its dependents have been.
+    # Roots may themselves be dependencies of other roots.
+    resolution = []
+    queue = collections.deque(root for root in roots if not in_degree[root])
+    while queue:
+        current = queue.popleft()
+        current.visit()
         resolution.append(current)
+        for dep in current.deps:
+            in_degree[dep] -= 1
+            if not in_degree[dep]:
+                queue.append(dep)
+
+    if len(resolution) < len(in_degree):
+        # Only nodes that are part of, or depend on, a cycle are left over.
+        cycle = _find_cycle(roots, lambda node: node.deps)
+        raise CycleError([node.entity for node in cycle])
+
+    resolution.reverse()
+    return resolution
 
-    unique = []
-    while resolution:
-        node = resolution.pop()
-        if node in unique:
+
+def _find_cycle(
+    nodes: typing.Iterable[T], deps: typing.Callable[[T], typing.Iterable[T]]
+) -> typing.List[T]:
+    # Depth first search for a dependency that is still on the path.
+    done: typing.Set[T] = set()
+    for start in nodes:
+        if start in done:
             continue
-        node.visit()
-        unique.append(node)
+        path = [start]
+        stack = [iter(deps(start))]
+        while stack:
+            for dep in stack[-1]:
+                if dep in path:
+                    return path[path.index(dep) :] + [dep]
+                if dep not in done:
+                    path.append(dep)
+                    stack.append(iter(deps(dep)))
+                    break
+            else:
+                stack.pop()
+                done.add(path.pop())
+    return []
+
+
+def resolve_dependencies(node: Node) -> typing.List[lib.SyncEntity]:
+    """
+    Produce a list of entities reachable from the given root of graph in the
+    order in which those should be synced. Every entity comes after the
+    entities it depends on and shared dependencies are only included once.
+    """
+
+    return [current.entity for current in _resolve((node,))]
+
+
+def resolve_dependencies_many(
+    nodes: typing.Sequence[Node],
+) -> typing.List[lib.SyncEntity]:
+    """
+    Like `resolve_dependencies`, but for the roots of a graph generated by
+    `generate_graph_many`. Each entity is included once across all roots.
+    """
+
+    return [current.entity for current in _resolve(nodes)]
+
+
+def resolve_waves(node: Node) -> typing.List[typing.List[lib.SyncEntity]]:
+    """
+    Group the entities reachable from the given root of graph into waves.
+    Entities of a wave only depend on entities of earlier waves, so each wave
+    can be synced concurrently once the previous one has completed.
+
+    An entity is placed in the earliest wave possible, so the number of waves
+    is the depth of the graph. Within a wave, entities keep the order given
+    by `resolve_dependencies`.
+    """
+
+    return _waves((node,))
+
+
+def resolve_waves_many(
+    nodes: typing.Sequence[Node],
+) -> typing.List[typing.List[lib.SyncEntity]]:
+    """
+    Like `resolve_waves`, but for the roots of a graph generated by
+    `generate_graph_many`. Each entity is included once across all roots.
+    """
+
+    return _waves(nodes)
+
+
+def _waves(nodes: typing.Sequence[Node]) -> typing.List[typing.List[lib.SyncEntity]]:
+    level: typing.Dict[Node, int] = {}
+    waves: typing.List[typing.List[lib.SyncEntity]] = []
+    for current in _resolve(nodes):
+        # Dependencies always come first, so their level is already known.
+        wave = max((level[dep] + 1 for dep in current.deps), default=0)
+        level[current] = wave
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(current.entity)
+    return waves
+
+
+class CompactGraph:
+    """
+    Dependency graph held in flat arrays rather than a `Node` per entity.
+
+    Entities are numbered in the order they are reached from the root, which
+    is entity 0. The dependencies of entity ``i`` are the entity numbers in
+    ``targets[offsets[i] : offsets[i + 1]]``. This takes a fraction of the
+    memory of a graph of nodes, which matters for graphs with many entities.
+    """
+
+    __slots__ = ("entities", "offsets", "targets")
+
+    def __init__(self, root: Node):
+        index = {root: 0}
+        nodes = [root]
+        self.offsets = array.array("q", [0])
+        self.targets = array.array("q")
+        # Nodes are appended while iterating, so every reachable one is seen.
+        for node in nodes:
+            for dep in node.deps:
+                i = index.get(dep)
+                if i is None:
+                    i = index[dep] = len(nodes)
+                    nodes.append(dep)
+                self.targets.append(i)
+            self.offsets.append(len(self.targets))
+        self.entities = [node.entity for node in nodes]
+
+    def __len__(self):
+        return len(self.entities)
+
+    def dependencies(self, i: int) -> array.array:
+        return self.targets[self.offsets[i] : self.offsets[i + 1]]
+
+    def resolve_dependencies(self) -> typing.List[lib.SyncEntity]:
+        """Same as `resolve_dependencies` for the graph of the root."""
+
+        in_degree = array.array("q", bytes(8 * len(self)))
+        for i in self.targets:
+            in_degree[i] += 1
+
+        # A root with dependents can only be part of a cycle.
+        resolution = []
+        queue = collections.deque([] if in_degree[0] else [0])
+        while queue:
+            current = queue.popleft()
+            resolution.append(current)
+            for i in self.dependencies(current):
+                in_degree[i] -= 1
+                if not in_degree[i]:
+                    queue.append(i)
+
+        if len(resolution) < len(self):
+            cycle = _find_cycle([0], self.dependencies)
+            raise CycleError([self.entities[i] for i in cycle])
 
-    return [node.entity for node in unique]
+        return [self.entities[i] for i in reversed(resolution)]
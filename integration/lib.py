@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 
 import abc
+import zlib
 import enum
+import functools
+import contextvars
+import heapq
+import bisect
+import contextlib
+import itertools
+import collections
 import random
 import typing
 import string
 import threading
+import time
 import dataclasses
 
 
@@ -13,9 +22,282 @@ class DatastoreException(Exception):
     pass
 
 
+class ChangeFeedExpired(DatastoreException):
+    """Raised when changes have been trimmed from a feed before being read."""
+
+
+class ChangeOp(enum.Enum):
+    SAVE = "save"
+    REMOVE = "remove"
+    RESET = "reset"
+
+
+@dataclasses.dataclass(frozen=True)
+class Change:
+    seq: int
+    op: ChangeOp
+    key: typing.Any
+    record: typing.Optional[dict]
+
+
+class ChangeFeed:
+    """
+    Ordered log of changes made to one or more datastores. Every change gets
+    the next number of a monotonic sequence. Only the last ``retention``
+    changes are kept.
+    """
+
+    def __init__(self, retention: int = 10000):
+        self.retention = retention
+        self._changes: typing.Deque[Change] = collections.deque(maxlen=retention)
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def sequence(self) -> int:
+        """Sequence number of the latest change."""
+        return self._sequence
+
+    def append(self, op: ChangeOp, key=None, record=None) -> int:
+        with self._lock:
+            self._sequence += 1
+            self._changes.append(Change(self._sequence, op, key, record))
+            return self._sequence
+
+    def since(self, seq: int = 0) -> typing.Iterator[Change]:
+        """Yield changes made after ``seq``.
+
+        Raises:
+            ChangeFeedExpired: Changes after ``seq`` were already trimmed.
+                               The reader has to start over from a full scan.
+        """
+        with self._lock:
+            oldest = self._sequence - len(self._changes) + 1
+            if seq + 1 < oldest:
+                raise ChangeFeedExpired(
+                    f"Changes after {seq} are no longer retained. "
+                    f"Oldest retained change is {oldest}."
+                )
+            if seq > self._sequence:
+                # The reader's checkpoint belongs to an earlier feed, e.g.
+                # one from before a restart.
+                raise ChangeFeedExpired(
+                    f"Change {seq} is ahead of the feed at {self._sequence}."
+                )
+            changes = list(
+                itertools.islice(self._changes, max(seq + 1 - oldest, 0), None)
+            )
+        return iter(changes)
+
+
+class ReadWriteLock:
+    """
+    Lock that lets any number of readers in at once, or a single writer.
+    Waiting writers take precedence over new readers so that a steady stream
+    of reads cannot starve them.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class KeyAllocator(abc.ABC):
+    """Strategy used by datastores to pick keys for records without one."""
+
+    @abc.abstractmethod
+    def allocate(self, exists: typing.Callable[[typing.Any], bool]):
+        """Return a new key for which ``exists`` is false."""
+        raise NotImplementedError()
+
+
+class RandomKeyAllocator(KeyAllocator):
+    """Random keys drawn from ``keyspace``, retried until one is unused."""
+
+    def __init__(
+        self,
+        keyspace: str = string.ascii_lowercase + string.digits,
+        length: int = 6,
+        max_attempts: int = 100,
+    ):
+        self.keyspace = keyspace
+        self.length = length
+        self.max_attempts = max_attempts
+
+    def allocate(self, exists):
+        for _ in range(self.max_attempts):
+            key = "".join(random.choices(self.keyspace, k=self.length)).lower()
+            if not exists(key):
+                return key
+
+        raise DatastoreException(
+            f"Could not allocate a unique key after {self.max_attempts} attempts. "
+            "The keyspace may be exhausted."
+        )
+
+
+class SequenceKeyAllocator(KeyAllocator):
+    """Monotonically increasing keys. Keys that are already taken, such as
+    ones saved with an explicit primary key, are skipped."""
+
+    def __init__(
+        self, start: int = 1, key_type: typing.Callable[[int], typing.Any] = int
+    ):
+        self.key_type = key_type
+        # Advancing itertools.count is atomic, so no lock is needed.
+        self._counter = itertools.count(start)
+
+    def allocate(self, exists):
+        while True:
+            key = self.key_type(next(self._counter))
+            if not exists(key):
+                return key
+
+
+class BlockKeyAllocator(KeyAllocator):
+    """
+    Sequential keys handed out in blocks. Each thread reserves ``block_size``
+    keys from a shared counter at a time and then allocates from its own block
+    without any synchronization.
+    """
+
+    def __init__(
+        self,
+        start: int = 1,
+        block_size: int = 1024,
+        key_type: typing.Callable[[int], typing.Any] = int,
+    ):
+        self.block_size = block_size
+        self.key_type = key_type
+        self._blocks = itertools.count(start, block_size)
+        self._local = threading.local()
+
+    def allocate(self, exists):
+        local = self._local
+        while True:
+            if getattr(local, "next", None) is None or local.next >= local.end:
+                local.next = next(self._blocks)
+                local.end = local.next + self.block_size
+
+            key = self.key_type(local.next)
+            local.next += 1
+            if not exists(key):
+                return key
+
+
+def _key_order(key) -> typing.Tuple[str, typing.Any]:
+    """Sort key for datastore keys. Grouping by type name first lets keys of
+    different types, such as generated ints and explicit strings, be ordered
+    together."""
+    return (type(key).__name__, key)
+
+
+class _SortedKeys:
+    """
+    Sorted list split into blocks of up to ``2 * load`` items. Inserts and
+    removals only shift the items of one block, rather than the whole list.
+    """
+
+    def __init__(self, items: typing.Iterable, load: int = 512):
+        items = sorted(items)
+        self._load = load
+        self._blocks = [items[i : i + load] for i in range(0, len(items), load)]
+        self._maxes = [block[-1] for block in self._blocks]
+
+    def add(self, item):
+        blocks, maxes = self._blocks, self._maxes
+        if not blocks:
+            blocks.append([item])
+            maxes.append(item)
+            return
+
+        i = min(bisect.bisect_left(maxes, item), len(maxes) - 1)
+        block = blocks[i]
+        bisect.insort(block, item)
+        maxes[i] = block[-1]
+        if len(block) > 2 * self._load:
+            blocks.insert(i + 1, block[self._load :])
+            del block[self._load :]
+            maxes.insert(i, block[-1])
+
+    def remove(self, item):
+        i = bisect.bisect_left(self._maxes, item)
+        block = self._blocks[i]
+        del block[bisect.bisect_left(block, item)]
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def after(self, item, size: int) -> list:
+        """Up to ``size`` items that sort after ``item``, or the first ones if
+        ``item`` is None."""
+
+        blocks = self._blocks
+        if item is None:
+            i = start = 0
+        else:
+            i = bisect.bisect_right(self._maxes, item)
+            start = bisect.bisect_right(blocks[i], item) if i < len(blocks) else 0
+
+        items: list = []
+        while i < len(blocks) and len(items) < size:
+            items.extend(blocks[i][start : start + size - len(items)])
+            i += 1
+            start = 0
+        return items
+
+
 class Datastore:
-    __storage: typing.Dict[str, dict]
-    __lock: threading.Lock
+    __storage: typing.MutableMapping[typing.Any, dict]
+    __indexes: typing.Dict[str, typing.Dict[typing.Any, typing.Dict[str, None]]]
+    __lock: ReadWriteLock
 
     def __init__(
         self,
@@ -23,23 +305,67 @@ class Datastore:
         fields: typing.Tuple[str, ...],
         pk: str = "id",
         keyspace: str = string.ascii_lowercase + string.digits,
+        indexes: typing.Tuple[str, ...] = (),
+        unique_indexes: typing.Tuple[str, ...] = (),
+        storage: typing.Optional[typing.MutableMapping[typing.Any, dict]] = None,
+        key_allocator: typing.Optional[KeyAllocator] = None,
+        changefeed: typing.Optional[ChangeFeed] = None,
     ):
+        """In-memory datastore of records keyed by ``pk``.
+
+        Args:
+            indexes: Fields to maintain a secondary index on. Several records
+                     may share the same value.
+            unique_indexes: Fields to maintain a secondary index on where
+                            each value may only belong to a single record.
+            storage: Storage engine holding the records, such as
+                     `storage.LogStorage`. Defaults to a plain dict.
+            key_allocator: Picks keys for records saved without a primary
+                           key. Defaults to random keys drawn from
+                           ``keyspace``.
+            changefeed: Feed that every change is recorded to. Changes are
+                        not recorded unless a feed is given.
+        """
         self.name = name
         self.fields = fields
         self.pk = pk
         self.keyspace = keyspace
+        self.unique_indexes = unique_indexes
+        self.key_allocator = key_allocator or RandomKeyAllocator(keyspace)
+        self.changefeed = changefeed
+
+        self.__storage = storage if storage is not None else {}
+        self.__commit = getattr(self.__storage, "commit", None)
+        # Each index maps a field value to the keys of records holding it. A
+        # dict is used instead of a set so that insertion order is retained.
+        self.__indexes = {field: {} for field in (*indexes, *unique_indexes)}
+        self.__lock = ReadWriteLock()
+        # Keys in iteration order, as built by `_key_order`. Built on the
+        # first scan and kept up to date by writes from then on.
+        self.__sorted_keys: typing.Optional[_SortedKeys] = None
 
-        self.__storage = {}
-        self.__lock = threading.Lock()
+        # Persistent engines may already hold records.
+        for key, record in self.__storage.items():
+            self._index_add(key, record)
 
     def __repr__(self):
-        record_count = len(self.__storage)
+        record_count = len(self)
         record_plural = "s" if record_count != 1 else ""
         return f"<{self.name.title()} Datastore: {record_count} record{record_plural}>"
 
-    def _generate_key(self, length=6) -> str:
-        out = "".join(random.choice(self.keyspace) for i in range(length))
-        return out.lower()
+    def __len__(self):
+        return len(self.__storage)
+
+    def __contains__(self, key):
+        with self.__lock.read():
+            return key in self.__storage
+
+    def _generate_key(self, reserved: typing.Container = ()):
+        # Must be called while holding the write lock.
+        storage = self.__storage
+        return self.key_allocator.allocate(
+            lambda key: key in storage or key in reserved
+        )
 
     def _validate_body(self, body):
         if not isinstance(body, dict):
@@ -52,49 +378,547 @@ class Datastore:
             elif field not in body_fields:
                 raise DatastoreException(f"Required field '{field}' is missing.")
 
+    def _index_value(self, field, record):
+        value = record.get(field)
+        try:
+            hash(value)
+        except TypeError:
+            raise DatastoreException(
+                f"Value of indexed field '{field}' must be hashable."
+            )
+        return value
+
+    def _check_indexes(self, records: typing.Dict[typing.Any, dict]):
+        """Ensure ``records`` can be applied without breaking any index."""
+
+        for field, index in self.__indexes.items():
+            claimed: typing.Dict[typing.Any, typing.Any] = {}
+            for key, body in records.items():
+                value = self._index_value(field, body)
+                if field not in self.unique_indexes:
+                    continue
+
+                # Records being overwritten by this batch release their value.
+                holders = [h for h in index.get(value, ()) if h not in records]
+                if holders or claimed.setdefault(value, key) != key:
+                    raise DatastoreException(
+                        f"Record with '{field}={value}' already exists in "
+                        f"{self.name} datastore."
+                    )
+
+    def _index_add(self, key, record):
+        for field, index in self.__indexes.items():
+            index.setdefault(self._index_value(field, record), {})[key] = None
+
+    def _index_discard(self, key, record):
+        for field, index in self.__indexes.items():
+            value = self._index_value(field, record)
+            holders = index.get(value)
+            if holders is None:
+                continue
+            holders.pop(key, None)
+            if not holders:
+                del index[value]
+
+    def is_indexed(self, field: str) -> bool:
+        return field in self.__indexes
+
+    def find(self, field: str, value) -> typing.List[dict]:
+        """Return records whose ``field`` equals ``value``.
+
+        Uses the secondary index on ``field`` when one is declared, otherwise
+        falls back to scanning every record.
+        """
+        with self.__lock.read():
+            if field not in self.__indexes:
+                return [
+                    record
+                    for record in self.__storage.values()
+                    if record.get(field, None) == value
+                ]
+
+            try:
+                keys = list(self.__indexes[field].get(value, ()))
+            except TypeError:
+                # Unhashable values can never be part of an index.
+                return []
+            return [self.__storage[key] for key in keys]
+
+    def count(self, field: typing.Optional[str] = None, value=None) -> int:
+        """Count records, optionally only those whose ``field`` equals
+        ``value``, without copying them."""
+
+        with self.__lock.read():
+            if field is None:
+                return len(self.__storage)
+            if field in self.__indexes:
+                try:
+                    return len(self.__indexes[field].get(value, ()))
+                except TypeError:
+                    # Unhashable values can never be part of an index.
+                    return 0
+            return sum(
+                1
+                for record in self.__storage.values()
+                if record.get(field, None) == value
+            )
+
+    def iterate(
+        self,
+        limit: typing.Optional[int] = None,
+        after_key=None,
+        batch_size: int = 1000,
+    ) -> typing.Iterator[dict]:
+        """Yield records in key order.
+
+        Records are fetched ``batch_size`` at a time and the lock is released
+        in between, so a long scan never holds up writers and only a batch of
+        records is held in memory at once. Records written during the scan
+        are picked up if their key sorts after the current position. Keys of
+        different types are grouped by type name before being compared.
+
+        Args:
+            limit: Maximum number of records to yield.
+            after_key: Only yield records whose key sorts after this one.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            with self.__lock.read():
+                after = None if after_key is None else _key_order(after_key)
+                keys = self._sorted_keys().after(after, size)
+                batch = [self.__storage[key] for _, key in keys]
+
+            if not batch:
+                return
+            yield from batch
+
+            after_key = batch[-1][self.pk]
+            if remaining is not None:
+                remaining -= len(batch)
+
+    def page(
+        self, limit: int, after_key=None
+    ) -> typing.Tuple[typing.List[dict], typing.Any]:
+        """Fetch one page of records in key order.
+
+        Returns:
+            The records and the cursor to pass as ``after_key`` for the next
+            page, which is None once there are no more records.
+        """
+        records = list(self.iterate(limit=limit + 1, after_key=after_key))
+        if len(records) <= limit:
+            return records, None
+        records = records[:limit]
+        return records, records[-1][self.pk]
+
+    @property
+    def sequence(self) -> int:
+        """Sequence number of the latest change, or 0 without a change feed."""
+        return self.changefeed.sequence if self.changefeed is not None else 0
+
+    def changes(self, since: int = 0) -> typing.Iterator[Change]:
+        """Yield changes made after sequence number ``since``.
+
+        Raises:
+            ChangeFeedExpired: Changes after ``since`` were already trimmed.
+            DatastoreException: The datastore has no change feed.
+        """
+        if self.changefeed is None:
+            raise DatastoreException(f"{self.name} Datastore has no change feed.")
+        return self.changefeed.since(since)
+
+    def _sorted_keys(self) -> _SortedKeys:
+        # Concurrent readers may both build the list, which is harmless.
+        keys = self.__sorted_keys
+        if keys is None:
+            keys = self.__sorted_keys = _SortedKeys(map(_key_order, self.__storage))
+        return keys
+
     def retrieve(self, key: typing.Optional[str] = None, raise_exception=False):
-        if key is None:
-            if not self.__lock.locked():
+        with self.__lock.read():
+            if key is None:
                 return list(self.__storage.values())
+            record = self.__storage.get(key)
 
-        if key not in self.__storage:
-            if raise_exception:
-                raise DatastoreException(
-                    f"Key '{key}' does not exist in {self.name} datastore."
-                )
-            return None
+        if record is None and raise_exception:
+            raise DatastoreException(
+                f"Key '{key}' does not exist in {self.name} datastore."
+            )
+        return record
+
+    def retrieve_many(self, keys: typing.Iterable) -> typing.Dict[typing.Any, dict]:
+        """Fetch several records at once. Missing keys are left out."""
+
+        with self.__lock.read():
+            storage = self.__storage
+            return {key: storage[key] for key in keys if key in storage}
+
+    def _apply(self, key, body) -> typing.Optional[dict]:
+        """Write the record, returning the one it replaced. The storage engine
+        is written first, so nothing changes if it rejects the record."""
+
+        previous = self.__storage.get(key)
+        self.__storage[key] = body
+        if previous is not None:
+            self._index_discard(key, previous)
+        elif self.__sorted_keys is not None:
+            self.__sorted_keys.add(_key_order(key))
+        self._index_add(key, body)
+        return previous
+
+    def _revert(self, key, previous: typing.Optional[dict]):
+        """Undo `_apply`, given the record it returned."""
+
+        if previous is not None:
+            self._apply(key, previous)
+        else:
+            self._forget(key, self.__storage.pop(key))
+
+    def _forget(self, key, record: dict):
+        self._index_discard(key, record)
+        if self.__sorted_keys is not None:
+            self.__sorted_keys.remove(_key_order(key))
 
-        if not self.__lock.locked():
-            return self.__storage.get(key)
+    def _record(self, op: ChangeOp, key, record: typing.Optional[dict]):
+        if self.changefeed is not None:
+            self.changefeed.append(op, key, record)
 
-        raise DatastoreException("Record is locked. Please try again.")
+    def _discard(self, key):
+        record = self.__storage.pop(key, None)
+        if record is not None:
+            self._forget(key, record)
+            self._record(ChangeOp.REMOVE, key, record)
 
     def save(self, body: dict) -> str:
         self._validate_body(body)
-        self.__lock.acquire()
 
-        if self.pk in body:
-            key: str = body[self.pk]
-        else:
-            key = self._generate_key()
-            body[self.pk] = key
+        with self.__lock.write():
+            if self.pk in body:
+                key: str = body[self.pk]
+            else:
+                key = self._generate_key()
 
-        self.__storage[key] = body
-        self.__lock.release()
+            self._check_indexes({key: body})
+            body[self.pk] = key
+            self._apply(key, body)
+            self._record(ChangeOp.SAVE, key, body)
+        self._commit()
         return key
 
+    def save_many(self, bodies: typing.Iterable[dict]) -> typing.List[str]:
+        """Save a batch of records under a single lock acquisition.
+
+        The whole batch is validated before anything is written, so either
+        every record is saved or none are.
+
+        Returns:
+            Keys of the saved records, in the order they were given.
+        """
+        bodies = list(bodies)
+        for body in bodies:
+            self._validate_body(body)
+
+        with self.__lock.write():
+            keys: typing.List[typing.Any] = []
+            reserved: typing.Set[typing.Any] = set()
+            for body in bodies:
+                if self.pk in body:
+                    keys.append(body[self.pk])
+                else:
+                    key = self._generate_key(reserved)
+                    reserved.add(key)
+                    keys.append(key)
+            self._check_indexes(dict(zip(keys, bodies)))
+
+            for key, body in zip(keys, bodies):
+                body[self.pk] = key
+            _apply_batch([(self, key, body) for key, body in zip(keys, bodies)])
+        self._commit()
+        return keys
+
     def remove(self, key) -> None:
-        self.__lock.acquire()
+        with self.__lock.write():
+            self._discard(key)
+        self._commit()
+
+    def remove_many(self, keys: typing.Iterable) -> None:
+        with self.__lock.write():
+            for key in keys:
+                self._discard(key)
+        self._commit()
+
+    def reset(self) -> None:
+        with self.__lock.write():
+            self._clear()
+            if self.changefeed is not None:
+                self.changefeed.append(ChangeOp.RESET)
+        self._commit()
+
+    def _clear(self):
+        # Callers hold the write lock and record the reset themselves.
+        self.__storage.clear()
+        self.__sorted_keys = None
+        for index in self.__indexes.values():
+            index.clear()
+
+    def _write_locked(self) -> typing.ContextManager:
+        """Hold the write lock, for callers applying records with `_apply`."""
+        return self.__lock.write()
+
+    def _commit(self):
+        # Durable engines are committed outside of the write lock so that
+        # concurrent writers can share a single flush.
+        if self.__commit is not None:
+            self.__commit()
+
+
+def _apply_batch(writes: typing.Sequence[typing.Tuple[Datastore, typing.Any, dict]]):
+    """Apply records to their datastores, either all of them or none. Callers
+    hold the write lock of every datastore involved."""
+
+    applied = []
+    try:
+        for store, key, body in writes:
+            applied.append((store, key, store._apply(key, body)))
+    except Exception:
+        for store, key, previous in reversed(applied):
+            store._revert(key, previous)
+        raise
+
+    # Changes are only recorded once the whole batch is in.
+    for store, key, body in writes:
+        store._record(ChangeOp.SAVE, key, body)
+
+
+class ShardedDatastore:
+    """
+    Datastore that partitions its keys across several `Datastore` shards, each
+    with its own lock. Writers only contend with writers of the same shard and
+    whole-store reads lock one shard at a time.
+
+    Unique indexes are not supported since uniqueness can't be enforced
+    without locking every shard.
+    """
+
+    shards: typing.Tuple[Datastore, ...]
+
+    def __init__(
+        self,
+        name: str,
+        fields: typing.Tuple[str, ...],
+        pk: str = "id",
+        keyspace: str = string.ascii_lowercase + string.digits,
+        indexes: typing.Tuple[str, ...] = (),
+        key_allocator: typing.Optional[KeyAllocator] = None,
+        changefeed: typing.Optional[ChangeFeed] = None,
+        shard_count: int = 16,
+        storage_factory: typing.Optional[
+            typing.Callable[[int], typing.MutableMapping[typing.Any, dict]]
+        ] = None,
+    ):
+        """
+        Args:
+            shard_count: Number of shards to partition keys across.
+            storage_factory: Called with the shard number to create the
+                             storage engine of each shard.
+        """
+        self.name = name
+        self.fields = fields
+        self.pk = pk
+        self.keyspace = keyspace
+        self.key_allocator = key_allocator or RandomKeyAllocator(keyspace)
+        # Shards share one feed so that changes are ordered across the store.
+        self.changefeed = changefeed
+
+        # Generated keys are reserved until their record is saved, so that
+        # concurrent writers never allocate the same key.
+        self._reserved: typing.Set[typing.Any] = set()
+        self._allocation_lock = threading.Lock()
+
+        self.shards = tuple(
+            Datastore(
+                name=name,
+                fields=fields,
+                pk=pk,
+                keyspace=keyspace,
+                indexes=indexes,
+                storage=storage_factory(i) if storage_factory is not None else None,
+                changefeed=self.changefeed,
+            )
+            for i in range(shard_count)
+        )
+
+    def __repr__(self):
+        record_count = len(self)
+        record_plural = "s" if record_count != 1 else ""
+        return f"<{self.name.title()} Datastore: {record_count} record{record_plural}>"
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def _shard(self, key) -> Datastore:
+        # Routing must not depend on Python's per-process hash randomization,
+        # otherwise persisted shards would be looked up in the wrong place
+        # after a restart.
+        if isinstance(key, int):
+            return self.shards[key % len(self.shards)]
+        return self.shards[zlib.crc32(str(key).encode()) % len(self.shards)]
+
+    def _prepare(self, body: dict) -> typing.Tuple[typing.Any, bool]:
+        """Validate the body and give it a key if it has none. Returns the key
+        and whether it was reserved, in which case it must be released."""
+
+        self.shards[0]._validate_body(body)
+        if self.pk in body:
+            return body[self.pk], False
+
+        with self._allocation_lock:
+            key = self.key_allocator.allocate(
+                lambda key: key in self._reserved or key in self._shard(key)
+            )
+            self._reserved.add(key)
+        body[self.pk] = key
+        return key, True
+
+    def _release(self, keys: typing.Iterable):
+        with self._allocation_lock:
+            self._reserved.difference_update(keys)
+
+    def is_indexed(self, field: str) -> bool:
+        return self.shards[0].is_indexed(field)
+
+    def find(self, field: str, value) -> typing.List[dict]:
+        return [
+            record for shard in self.shards for record in shard.find(field, value)
+        ]
+
+    def count(self, field: typing.Optional[str] = None, value=None) -> int:
+        return sum(shard.count(field, value) for shard in self.shards)
+
+    def iterate(
+        self,
+        limit: typing.Optional[int] = None,
+        after_key=None,
+        batch_size: int = 1000,
+    ) -> typing.Iterator[dict]:
+        """Yield records in key order by merging the shards' iterators."""
+
+        merged = heapq.merge(
+            *(
+                shard.iterate(after_key=after_key, batch_size=batch_size)
+                for shard in self.shards
+            ),
+            key=lambda record: _key_order(record[self.pk]),
+        )
+        return itertools.islice(merged, limit)
+
+    def page(
+        self, limit: int, after_key=None
+    ) -> typing.Tuple[typing.List[dict], typing.Any]:
+        records = list(self.iterate(limit=limit + 1, after_key=after_key))
+        if len(records) <= limit:
+            return records, None
+        records = records[:limit]
+        return records, records[-1][self.pk]
+
+    @property
+    def sequence(self) -> int:
+        return self.shards[0].sequence
+
+    def changes(self, since: int = 0) -> typing.Iterator[Change]:
+        return self.shards[0].changes(since)
+
+    def retrieve(self, key: typing.Optional[str] = None, raise_exception=False):
+        if key is None:
+            return [record for shard in self.shards for record in shard.retrieve()]
+        return self._shard(key).retrieve(key, raise_exception=raise_exception)
+
+    def retrieve_many(self, keys: typing.Iterable) -> typing.Dict[typing.Any, dict]:
+        found = {}
+        for shard, shard_keys in self._group(keys).items():
+            found.update(shard.retrieve_many(shard_keys))
+        return found
+
+    def save(self, body: dict) -> str:
+        key, is_reserved = self._prepare(body)
+        try:
+            return self._shard(key).save(body)
+        finally:
+            if is_reserved:
+                self._release((key,))
+
+    def save_many(self, bodies: typing.Iterable[dict]) -> typing.List[str]:
+        """
+        Save a batch of records. Every shard the batch touches is locked while
+        it is checked and applied, so either every record is saved or none
+        are, and readers never observe part of the batch.
+        """
+        bodies = list(bodies)
+        keys: typing.List[typing.Any] = []
+        reserved: typing.List[typing.Any] = []
         try:
-            del self.__storage[key]
-        except KeyError:
-            pass
-        self.__lock.release()
+            for body in bodies:
+                key, is_reserved = self._prepare(body)
+                keys.append(key)
+                if is_reserved:
+                    reserved.append(key)
+
+            batches: typing.Dict[Datastore, typing.List[dict]] = {}
+            for key, body in zip(keys, bodies):
+                batches.setdefault(self._shard(key), []).append(body)
+            # Shards are always locked in the same order to avoid deadlocks
+            # between concurrent batches.
+            shards = sorted(batches, key=self.shards.index)
+
+            with contextlib.ExitStack() as stack:
+                for shard in shards:
+                    stack.enter_context(shard._write_locked())
+                for shard in shards:
+                    batch = batches[shard]
+                    shard._check_indexes({body[self.pk]: body for body in batch})
+                _apply_batch(
+                    [
+                        (shard, body[self.pk], body)
+                        for shard in shards
+                        for body in batches[shard]
+                    ]
+                )
+        finally:
+            # Only generated keys are reserved. Explicit ones may match a key
+            # reserved by another writer, which must be left alone.
+            self._release(reserved)
+
+        for shard in shards:
+            shard._commit()
+        return keys
+
+    def remove(self, key) -> None:
+        self._shard(key).remove(key)
+
+    def remove_many(self, keys: typing.Iterable) -> None:
+        for shard, shard_keys in self._group(keys).items():
+            shard.remove_many(shard_keys)
 
     def reset(self) -> None:
-        self.__lock.acquire()
-        self.__storage = {}
-        self.__lock.release()
+        """Remove every record, recording a single reset in the change feed."""
+
+        with contextlib.ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard._write_locked())
+            for shard in self.shards:
+                shard._clear()
+            if self.changefeed is not None:
+                self.changefeed.append(ChangeOp.RESET)
+
+        for shard in self.shards:
+            shard._commit()
+
+    def _group(self, keys: typing.Iterable) -> typing.Dict[Datastore, list]:
+        groups: typing.Dict[Datastore, list] = {}
+        for key in keys:
+            groups.setdefault(self._shard(key), []).append(key)
+        return groups
 
 
 ORM = typing.TypeVar("ORM")
@@ -105,30 +929,58 @@ class SyncEntity:
     """
     This is an interface for "syncable" entities. It should be implemented for
     each model that needs to be synced with an external system.
+
+    Entities are identified by their class and local id, which are kept in
+    ``identity``. Entities with the same identity are equal and hash alike.
     """
 
     local_id: int
     remote_id: typing.Optional[str]
 
+    def __post_init__(self):
+        # Not a field, so that it is left out of serialization.
+        object.__setattr__(self, "identity", (type(self), self.local_id))
+
     def __eq__(self, other):
-        return (
-            type(self).__name__ == type(other).__name__
-            and self.local_id == other.local_id
-        )
+        if not isinstance(other, SyncEntity):
+            return NotImplemented
+        return self.identity == other.identity
+
+    def __hash__(self):
+        return hash(self.identity)
 
     def __str__(self):
         return f"<{type(self).__name__} local_id={self.local_id} remote_id={self.remote_id}>"
 
     def serialize(self):
-        """Produces data that is ready to be sent to the remote system."""
+        """Produces data that is ready to be sent to the remote system.
+
+        Entities held by a field are sent as the remote id in ``<field>_id``
+        and lists of entities are serialized in place.
+        """
 
-        return dataclasses.asdict(self)
+        return _serializer(type(self))(self)
 
     @classmethod
     def deserialize(cls, data):
-        """Accepts data from the remote system and instantiates a SyncEntity."""
+        """Accepts data from the remote system and instantiates a SyncEntity.
 
-        return cls(**data)
+        Entities held by a field may be given as entities or as dicts, which
+        are deserialized in turn, or by their remote id in ``<field>_id`` as
+        produced by `serialize`, which gives a `reference`.
+        """
+
+        return _deserializer(cls)(cls, data)
+
+    @classmethod
+    def reference(cls, remote_id: str) -> "SyncEntity":
+        """An entity only known by its remote id. Its other fields are None."""
+
+        values = {field.name: None for field in dataclasses.fields(cls) if field.init}
+        entity = cls(**{**values, "remote_id": remote_id})
+        # References have no local id, so they are told apart by remote id.
+        object.__setattr__(entity, "identity", (cls, None, remote_id))
+        return entity
 
     def to_local(cls) -> ORM:
         """Create a local entity from instance of SyncEntity."""
@@ -140,6 +992,220 @@ class SyncEntity:
         implemented on a per remote entity basis."""
         raise NotImplementedError()
 
+    @classmethod
+    def from_local_many(cls, models: typing.Iterable[ORM]) -> typing.List["SyncEntity"]:
+        """Convert several local entities. Backends may override this to batch
+        the lookups that `from_local` makes."""
+        return [cls.from_local(model) for model in models]
+
+
+class InternTable:
+    """Keeps a single instance of every entity identity added to it."""
+
+    def __init__(self):
+        self._entities: typing.Dict[typing.Tuple[type, typing.Any], SyncEntity] = {}
+
+    def __len__(self):
+        return len(self._entities)
+
+    def get(
+        self, identity: typing.Tuple[type, typing.Any]
+    ) -> typing.Optional[SyncEntity]:
+        return self._entities.get(identity)
+
+    def intern(self, entity: SyncEntity) -> SyncEntity:
+        """Return the instance first added with the identity of ``entity``."""
+        return self._entities.setdefault(entity.identity, entity)
+
+
+_intern_table: contextvars.ContextVar[
+    typing.Optional[InternTable]
+] = contextvars.ContextVar("intern_table", default=None)
+
+
+@contextlib.contextmanager
+def interning(
+    table: typing.Optional[InternTable] = None,
+) -> typing.Iterator[InternTable]:
+    """Intern entities passed to `intern` within the block in ``table``, or in
+    a new table."""
+
+    table = table if table is not None else InternTable()
+    token = _intern_table.set(table)
+    try:
+        yield table
+    finally:
+        _intern_table.reset(token)
+
+
+def intern(entity: SyncEntity) -> SyncEntity:
+    """Return the interned instance of ``entity`` when within `interning`,
+    otherwise ``entity`` itself."""
+
+    table = _intern_table.get()
+    return table.intern(entity) if table is not None else entity
+
+
+def memoize_from_local(from_local: typing.Callable) -> typing.Callable:
+    """Decorate the ``from_local`` of a SyncEntity whose local id is the ``id``
+    of the local model. Within `interning`, each local model is then only
+    converted once, and its shared dependencies are built a single time."""
+
+    @functools.wraps(from_local)
+    def wrapper(cls, model):
+        table = _intern_table.get()
+        if table is None:
+            return from_local(cls, model)
+        entity = table.get((cls, model.id))
+        if entity is None:
+            entity = table.intern(from_local(cls, model))
+        return entity
+
+    return wrapper
+
+
+class FieldKind(enum.Enum):
+    SCALAR = 0
+    ENTITY = 1
+    OPTIONAL = 2
+    LIST = 3
+
+
+@dataclasses.dataclass(frozen=True)
+class FieldPlan:
+    """How the fields of a SyncEntity class are laid out.
+
+    Attributes:
+        fields: ``(name, kind, type)`` of every field in declaration order.
+                For entity fields, ``type`` is the SyncEntity class the
+                field holds.
+        dependencies: ``(name, kind)`` of the fields holding other entities,
+                      in declaration order.
+    """
+
+    fields: typing.Tuple[typing.Tuple[str, FieldKind, typing.Any], ...]
+    dependencies: typing.Tuple[typing.Tuple[str, FieldKind], ...]
+
+
+def _is_entity(hint) -> bool:
+    return isinstance(hint, type) and issubclass(hint, SyncEntity)
+
+
+@functools.lru_cache(maxsize=None)
+def field_plan(cls: typing.Type[SyncEntity]) -> FieldPlan:
+    """Inspect the fields of ``cls`` once, so that code walking many
+    instances of it only needs attribute access."""
+
+    try:
+        hints = typing.get_type_hints(cls)
+    except NameError:
+        # Forward references that can't be resolved from the class' module.
+        hints = {}
+
+    fields = []
+    for field in dataclasses.fields(cls):
+        hint = hints.get(field.name, field.type)
+        origin = typing.get_origin(hint)
+        args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+
+        if origin is list and args and _is_entity(args[0]):
+            fields.append((field.name, FieldKind.LIST, args[0]))
+        elif origin is typing.Union and len(args) == 1 and _is_entity(args[0]):
+            fields.append((field.name, FieldKind.OPTIONAL, args[0]))
+        elif _is_entity(hint):
+            fields.append((field.name, FieldKind.ENTITY, hint))
+        else:
+            fields.append((field.name, FieldKind.SCALAR, hint))
+
+    return FieldPlan(
+        fields=tuple(fields),
+        dependencies=tuple(
+            (name, kind) for name, kind, _ in fields if kind is not FieldKind.SCALAR
+        ),
+    )
+
+
+def _compile(source: str, name: str, namespace: dict) -> typing.Callable:
+    exec(source, namespace)
+    return namespace[name]
+
+
+@functools.lru_cache(maxsize=None)
+def _serializer(cls: typing.Type[SyncEntity]) -> typing.Callable:
+    # The payload is built by a function generated for the class, so that
+    # serializing does no per-field inspection and no intermediate copies.
+    items = []
+    for name, kind, _ in field_plan(cls).fields:
+        if kind is FieldKind.SCALAR:
+            items.append(f"{name!r}: self.{name}")
+        elif kind is FieldKind.ENTITY:
+            items.append(f"{name + '_id'!r}: self.{name}.remote_id")
+        elif kind is FieldKind.OPTIONAL:
+            items.append(
+                f"{name + '_id'!r}: None if self.{name} is None"
+                f" else self.{name}.remote_id"
+            )
+        else:
+            items.append(f"{name!r}: [item.serialize() for item in self.{name}]")
+
+    source = "def serialize(self):\n    return {%s}\n" % ", ".join(items)
+    return _compile(source, "serialize", {})
+
+
+def _load(entity_class: typing.Type[SyncEntity], value):
+    if value is None or isinstance(value, SyncEntity):
+        return value
+    return entity_class.deserialize(value)
+
+
+def _reference(entity_class: typing.Type[SyncEntity], remote_id):
+    return None if remote_id is None else entity_class.reference(remote_id)
+
+
+@functools.lru_cache(maxsize=None)
+def _deserializer(cls: typing.Type[SyncEntity]) -> typing.Callable:
+    namespace: typing.Dict[str, typing.Any] = {"_load": _load, "_reference": _reference}
+    required = []
+    optional = []
+    for i, (name, kind, hint) in enumerate(field_plan(cls).fields):
+        field = cls.__dataclass_fields__[name]
+        if not field.init:
+            continue
+
+        value = f"data[{name!r}]"
+        present = f"{name!r} in data"
+        if kind is FieldKind.LIST:
+            namespace[f"_cls{i}"] = hint
+            value = f"[_load(_cls{i}, item) for item in {value}]"
+        elif kind is not FieldKind.SCALAR:
+            # Entities are either given in full or by the remote id in
+            # `<field>_id`, as written by the serializer.
+            namespace[f"_cls{i}"] = hint
+            id_key = name + "_id"
+            value = (
+                f"(_load(_cls{i}, {value}) if {present}"
+                f" else _reference(_cls{i}, data[{id_key!r}]))"
+            )
+            present = f"{present} or {id_key!r} in data"
+
+        if (
+            field.default is dataclasses.MISSING
+            and field.default_factory is dataclasses.MISSING
+        ):
+            required.append(f"{name}={value}")
+        else:
+            # Fields with a default may be left out.
+            optional.append(f"    if {present}:\n")
+            optional.append(f"        kwargs[{name!r}] = {value}\n")
+
+    source = (
+        "def deserialize(cls, data):\n"
+        f"    kwargs = dict({', '.join(required)})\n"
+        f"{''.join(optional)}"
+        "    return cls(**kwargs)\n"
+    )
+    return _compile(source, "deserialize", namespace)
+
 
 class SyncStatus(enum.Enum):
     CREATED = 0
@@ -154,6 +1220,23 @@ class SyncResult:
     message: str
 
 
+@dataclasses.dataclass
+class SyncSummary:
+    """Outcome of syncing a batch of entities.
+
+    Attributes:
+        roots: Number of entities the batch was asked to sync.
+        entities: Number of entities synced, including dependencies.
+        statuses: Number of results per status.
+        timings: Seconds spent on each stage of the sync.
+    """
+
+    roots: int = 0
+    entities: int = 0
+    statuses: typing.Dict[SyncStatus, int] = dataclasses.field(default_factory=dict)
+    timings: typing.Dict[str, float] = dataclasses.field(default_factory=dict)
+
+
 @dataclasses.dataclass
 class Mapping:
     local_remote_entity: typing.Dict[type, type]
@@ -183,3 +1266,146 @@ class Client(abc.ABC):
     @abc.abstractmethod
     def search(self, key, value) -> Response:
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def list(self, limit=None, after=None) -> Response:
+        """Fetch a page of records. The response body holds the records
+        under "results" and the cursor for the next page under "next"."""
+        raise NotImplementedError()
+
+
+class AsyncClient(abc.ABC):
+    """Same as `Client`, for remote systems called from asyncio."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+
+    @abc.abstractmethod
+    async def send(self, body) -> Response:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def retrieve(self, key) -> Response:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def search(self, key, value) -> Response:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def list(self, limit=None, after=None) -> Response:
+        raise NotImplementedError()
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` requests per second on average and bursts of up to
+    ``burst`` requests. Safe to share between threads and asyncio tasks, since
+    the lock is only held to take a token and never while waiting for one.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate must be positive and burst at least 1.")
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        # Time at which the bucket held ``_tokens``. It is in the future while
+        # the bucket is paused.
+        self._updated = clock()
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            elapsed = now - self._updated
+            self._tokens = min(self._tokens + elapsed * self.rate, self.burst)
+            self._updated = now
+
+    def _wait(self, now: float) -> float:
+        return max(self._updated - now, 0.0) + max(-self._tokens, 0.0) / self.rate
+
+    def reserve(self) -> float:
+        """Take a token, returning the seconds to wait before using it.
+
+        Tokens may be taken before they are available, so every caller gets
+        its own turn without having to retry.
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= 1
+            return self._wait(now)
+
+    def try_acquire(self) -> float:
+        """Take a token only if one is available now. Returns 0 if one was
+        taken, otherwise the seconds until one will be."""
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self._updated <= now and self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return max(self._updated - now, 0.0) + (1 - self._tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the given number of seconds, such as when a
+        server asks for requests to be retried later. A single token is
+        available once the pause is over."""
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens = min(self._tokens, 1.0)
+            self._updated = max(self._updated, now + seconds)
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by endpoint. Endpoints without a configured limit are
+    not limited.
+    """
+
+    def __init__(
+        self, limits: typing.Optional[typing.Dict[str, typing.Tuple[float, int]]] = None
+    ):
+        self._buckets: typing.Dict[str, TokenBucket] = {}
+        for endpoint, (rate, burst) in (limits or {}).items():
+            self.configure(endpoint, rate, burst)
+
+    def configure(self, endpoint: str, rate: float, burst: int = 1):
+        """Limit the endpoint to ``rate`` requests per second, with bursts of up
+        to ``burst`` requests."""
+        self._buckets[endpoint] = TokenBucket(rate, burst)
+
+    def remove(self, endpoint: str):
+        self._buckets.pop(endpoint, None)
+
+    def clear(self):
+        self._buckets.clear()
+
+    def reserve(self, endpoint: str) -> float:
+        """Take a token for the endpoint, returning the seconds to wait before
+        sending the request."""
+
+        bucket = self._buckets.get(endpoint)
+        return bucket.reserve() if bucket is not None else 0.0
+
+    def acquire(self, endpoint: str):
+        """Block until a request may be sent to the endpoint."""
+
+        wait = self.reserve(endpoint)
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, endpoint: str, seconds: float):
+        bucket = self._buckets.get(endpoint)
+        if bucket is not None:
+            bucket.pause(seconds)
@@ -1,18 +1,31 @@
 #!/usr/bin/env python3
-import os
 import time
 import typing
+import functools
+import itertools
+import dataclasses
+from concurrent import futures
 from integration import lib
 from integration import graph
 from integration.backends import get_backend
 
+if typing.TYPE_CHECKING:
+    import asyncio
 
-def sync(entity, backend: str) -> typing.Iterator[lib.SyncResult]:
+
+def sync(
+    entity, backend: str, max_workers: int = 1, force: bool = False
+) -> typing.Iterator[lib.SyncResult]:
     """Sync the given entity with remote backend.
 
     Args:
         entity: A fully deserialized instance of local entity.
         backend: Name of the backend to be used for syncing.
+        max_workers: Number of entities to sync concurrently. Entities are
+                     synced in waves where every entity of a wave only
+                     depends on earlier waves.
+        force: Sync every entity again, including those already synced.
+                Otherwise synced dependencies are skipped.
 
     Returns:
         An instance of SyncResult.
@@ -21,20 +34,13 @@ def sync(entity, backend: str) -> typing.Iterator[lib.SyncResult]:
         BackendError: Given backend does not exist.
     """
 
-    is_slow_mo = int(os.environ.get("SLOWMO", 0))
-
     # Lookup backend to used for syncing.
     _backend = get_backend(backend)
-    mapping = _backend.mapping
+    graph_root = _generate_graph(entity, _backend, force)
 
-    # Find and instantiate corresponding remote entity for the given local
-    # entity. The process will also instantiate any dependent entities.
-    remote_entity_class = mapping.local_remote_entity[type(entity)]
-    remote_entity = remote_entity_class.from_local(entity)
-
-    # Generate a dependency graph that will be used to put entities in the
-    # order in which they should be synced.
-    graph_root = graph.generate_graph(remote_entity)
+    if max_workers > 1:
+        yield from _sync_waves(_backend, graph_root, max_workers, force)
+        return
 
     # Resolve dependencies for the given graph root. It'll also remove
     # duplicates and only include shared dependencies once while
@@ -46,17 +52,280 @@ def sync(entity, backend: str) -> typing.Iterator[lib.SyncResult]:
             status=lib.SyncStatus.CREATED,
             message=f"Sync created for '{remote_entity}'",
         )
-        if is_slow_mo:
-            time.sleep(2)
-
         yield lib.SyncResult(
             status=lib.SyncStatus.IN_PROGRESS,
             message=f"Sync in progress for '{remote_entity}'",
         )
-        if is_slow_mo:
-            time.sleep(2)
+        yield _backend.sync(remote_entity, force=force)
+
+
+def _generate_graph(entity, _backend, force: bool) -> graph.Node:
+    # Find and instantiate corresponding remote entity for the given local
+    # entity. The process will also instantiate any dependent entities.
+    # Entities shared between dependencies are interned, so that each is only
+    # a single instance.
+    remote_entity_class = _backend.mapping.local_remote_entity[type(entity)]
+    with lib.interning():
+        remote_entity = remote_entity_class.from_local_many([entity])[0]
+
+    # Generate a dependency graph that will be used to put entities in the
+    # order in which they should be synced.
+    # Dependencies that are already synced are left out.
+    return graph.generate_graph(remote_entity, force=force)
+
+
+async def async_sync(
+    entity,
+    backend: str,
+    max_concurrency: int = 100,
+    force: bool = False,
+    semaphore: typing.Optional["asyncio.Semaphore"] = None,
+) -> typing.AsyncIterator[lib.SyncResult]:
+    """Sync the given entity with remote backend from asyncio.
+
+    Entities are synced in waves where every entity of a wave only depends on
+    earlier waves. The entities of a wave are synced concurrently and their
+    results are yielded as they complete.
+
+    Args:
+        entity: A fully deserialized instance of local entity.
+        backend: Name of the backend to be used for syncing.
+        max_concurrency: Number of entities to sync concurrently.
+        force: Sync every entity again, including those already synced.
+        semaphore: Bounds concurrency instead of ``max_concurrency``. Pass the
+                   same semaphore to several syncs to bound them together.
+
+    Raises:
+        BackendError: Given backend does not exist.
+    """
+
+    # Imported here since asyncio is slow to import and only needed by async
+    # callers, which already have it loaded.
+    import asyncio
+
+    _backend = get_backend(backend)
+    graph_root = _generate_graph(entity, _backend, force)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+    # Backends without asyncio support are run in threads.
+    push = getattr(_backend, "async_sync", None)
+    if push is None:
+        push = functools.partial(asyncio.to_thread, _backend.sync)
+
+    async def _sync(remote_entity):
+        async with semaphore:
+            return await push(remote_entity, force=force)
+
+    for wave in graph.resolve_waves(graph_root):
+        for remote_entity in wave:
+            yield lib.SyncResult(
+                status=lib.SyncStatus.CREATED,
+                message=f"Sync created for '{remote_entity}'",
+            )
+        for remote_entity in wave:
+            yield lib.SyncResult(
+                status=lib.SyncStatus.IN_PROGRESS,
+                message=f"Sync in progress for '{remote_entity}'",
+            )
+
+        tasks = [asyncio.ensure_future(_sync(remote_entity)) for remote_entity in wave]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Nothing is left running if the caller stops iterating early.
+            for task in tasks:
+                task.cancel()
+
+
+def _sync_waves(
+    _backend, graph_root: graph.Node, max_workers: int, force: bool
+) -> typing.Iterator[lib.SyncResult]:
+    # A wave is only started once every entity of the previous wave has been
+    # synced, since its entities may depend on any of them.
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for wave in graph.resolve_waves(graph_root):
+            for remote_entity in wave:
+                yield lib.SyncResult(
+                    status=lib.SyncStatus.CREATED,
+                    message=f"Sync created for '{remote_entity}'",
+                )
+            for remote_entity in wave:
+                yield lib.SyncResult(
+                    status=lib.SyncStatus.IN_PROGRESS,
+                    message=f"Sync in progress for '{remote_entity}'",
+                )
+            yield from executor.map(
+                functools.partial(_backend.sync, force=force), wave
+            )
+
+
+def sync_many(
+    entities: typing.Iterable,
+    backend: str,
+    force: bool = False,
+    on_result: typing.Optional[
+        typing.Callable[[lib.SyncEntity, lib.SyncResult], None]
+    ] = None,
+    processes: int = 1,
+    partition_key: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None,
+) -> lib.SyncSummary:
+    """Sync a batch of entities with remote backend.
+
+    The whole batch is converted and planned at once, so dependencies shared
+    by many entities, such as the vendor of many bills, are converted and
+    synced a single time.
+
+    With more than one process, the batch is split into partitions that are
+    converted and planned in a pool of worker processes. Workers only plan:
+    their plans are merged and deduplicated, and every remote call and
+    object map write is made from this process, so a dependency shared by
+    several partitions is still only created once. Workers may not see this
+    process's object maps, so remote ids are looked up again before pushing.
+
+    Args:
+        entities: Fully deserialized instances of local entities.
+        backend: Name of the backend to be used for syncing.
+        force: Sync every entity again, including those already synced.
+        on_result: Called with every remote entity and its result as soon as
+                   it has been synced, dependencies included.
+        processes: Number of worker processes to plan the batch with.
+        partition_key: Maps an entity to its partition. Entities sharing
+                       dependencies should share a partition, so that those
+                       are only planned once. Defaults to the backend's
+                       ``partition_key``, if it has one, or the entity
+                       itself.
+
+    Returns:
+        An instance of SyncSummary. Its timings hold "convert", "plan" and
+        "sync", or only "plan" and "sync" when planned by worker processes.
+
+    Raises:
+        BackendError: Given backend does not exist.
+    """
+
+    entities = list(entities)
+    summary = lib.SyncSummary(roots=len(entities))
+    _backend = get_backend(backend)
+    # Backends may push a whole wave at once and save its mappings in bulk.
+    push = getattr(_backend, "sync_many", None) or (
+        lambda wave, force: [_backend.sync(entity, force=force) for entity in wave]
+    )
+
+    planned_in_workers = processes > 1 and bool(entities)
+    if planned_in_workers:
+        start = time.perf_counter()
+        partition_key = (
+            partition_key
+            or getattr(_backend, "partition_key", None)
+            or _partition_key
+        )
+        partitions: typing.Dict[typing.Any, list] = {}
+        for entity in entities:
+            partitions.setdefault(partition_key(entity), []).append(entity)
+
+        # Partitions are spread over one chunk per process.
+        chunks = [[] for _ in range(min(processes, len(partitions)))]
+        for i, partition in enumerate(partitions.values()):
+            chunks[i % len(chunks)].extend(partition)
+
+        with futures.ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            plans = executor.map(
+                _plan_partition,
+                itertools.repeat(backend),
+                chunks,
+                itertools.repeat(force),
+            )
+            waves = _merge_waves(plans)
+        summary.timings["plan"] = time.perf_counter() - start
+    else:
+        waves = _plan(entities, _backend, force, summary.timings)
+
+    start = time.perf_counter()
+    for wave in waves:
+        if planned_in_workers and not force:
+            wave = _with_mapped_remote_ids(wave, _backend.mapping)
+        for remote_entity, result in zip(wave, push(wave, force=force)):
+            summary.entities += 1
+            summary.statuses[result.status] = summary.statuses.get(result.status, 0) + 1
+            if on_result is not None:
+                on_result(remote_entity, result)
+    summary.timings["sync"] = time.perf_counter() - start
+
+    return summary
+
+
+def _plan(
+    entities: list, _backend, force: bool, timings: typing.Dict[str, float]
+) -> typing.List[typing.List[lib.SyncEntity]]:
+    mapping = _backend.mapping
+
+    start = time.perf_counter()
+    remote_entities = []
+    with lib.interning():
+        # Local entities of the same type are converted together so that
+        # backends can batch their lookups.
+        for local_class, group in itertools.groupby(entities, key=type):
+            remote_entity_class = mapping.local_remote_entity[local_class]
+            remote_entities.extend(remote_entity_class.from_local_many(group))
+    timings["convert"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nodes = graph.generate_graph_many(remote_entities, force=force)
+    waves = graph.resolve_waves_many(nodes)
+    timings["plan"] = time.perf_counter() - start
+    return waves
+
+
+def _plan_partition(
+    backend: str, entities: list, force: bool
+) -> typing.List[typing.List[lib.SyncEntity]]:
+    # Runs in a worker process.
+    return _plan(entities, get_backend(backend), force, {})
+
+
+def _partition_key(entity) -> typing.Any:
+    return (type(entity), entity.id)
+
+
+def _with_mapped_remote_ids(
+    wave: typing.List[lib.SyncEntity], mapping: lib.Mapping
+) -> typing.List[lib.SyncEntity]:
+    # Fill in remote ids from this process's object maps, so that entities a
+    # worker planned without seeing their mapping are not created again.
+    unmapped: typing.Dict[type, list] = {}
+    for entity in wave:
+        if entity.remote_id is None and type(entity) in mapping.entity_datastore:
+            unmapped.setdefault(type(entity), []).append(entity.local_id)
+
+    records = {
+        entity_class: mapping.entity_datastore[entity_class].retrieve_many(local_ids)
+        for entity_class, local_ids in unmapped.items()
+    }
+    return [
+        dataclasses.replace(
+            entity, remote_id=records[type(entity)][entity.local_id]["remote_id"]
+        )
+        if entity.local_id in records.get(type(entity), ())
+        else entity
+        for entity in wave
+    ]
+
 
-        result = _backend.sync(remote_entity)
-        yield result
-        if is_slow_mo:
-            time.sleep(3)
+def _merge_waves(
+    plans: typing.Iterable[typing.List[typing.List[lib.SyncEntity]]],
+) -> typing.List[typing.List[lib.SyncEntity]]:
+    # The wave of an entity only depends on the entities below it, so an
+    # entity planned by several workers is in the same wave of each plan.
+    waves: typing.List[typing.List[lib.SyncEntity]] = []
+    seen: typing.Set[typing.Tuple[type, typing.Any]] = set()
+    for plan in plans:
+        for i, wave in enumerate(plan):
+            if i == len(waves):
+                waves.append([])
+            for entity in wave:
+                if entity.identity not in seen:
+                    seen.add(entity.identity)
+                    waves[i].append(entity)
+    return waves
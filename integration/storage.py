@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+import os
+import json
+import array
+import atexit
+import typing
+import threading
+import collections.abc
+
+from integration import lib
+
+# Storage engines that can be plugged into lib.Datastore. An engine is a
+# mutable mapping of key -> record. Engines may also define a `commit` method
+# which the datastore calls once every write operation has been applied.
+
+_SET = "s"
+_DELETE = "d"
+_CLEAR = "c"
+
+
+class LogStorage(collections.abc.MutableMapping):
+    """
+    Persists records to an append-only log while serving reads from memory.
+
+    Every write is appended to the log as a JSON line. Writers share fsync
+    calls through group commit: a background thread syncs whatever has been
+    appended since the last sync, and `commit` blocks until the caller's
+    writes are part of a synced group. On startup the log is read and replayed
+    to rebuild the in-memory table. Once enough of the log is made of
+    overwritten or removed records, it is compacted in the background.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: typing.Optional[typing.MutableMapping] = None,
+        sync_interval: float = 0.05,
+        compact_ratio: float = 0.5,
+        compact_min_entries: int = 10000,
+    ):
+        """
+        Args:
+            path: Location of the log file. It is created if missing.
+            table: In-memory mapping that holds the live records.
+            sync_interval: Longest time, in seconds, that appended writes wait
+                           before being fsynced.
+            compact_ratio: Fraction of stale log entries that triggers a
+                           compaction.
+            compact_min_entries: Logs with fewer entries are never compacted.
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_entries = compact_min_entries
+
+        self._table = table if table is not None else {}
+        self._entries = 0
+        self._appended = 0
+        self._synced = 0
+        self._closed = False
+        self._compacting = False
+
+        # Lock ordering is always `_sync_lock` before `_io_lock`. The io lock
+        # guards the table and appends, the sync lock guards the file handle
+        # while it is being fsynced or swapped out by compaction.
+        self._io_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_condition = threading.Condition()
+        self._sync_requested = threading.Event()
+
+        self._recover()
+        self._file = open(self.path, "ab")
+
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name=f"LogStorage flusher {path}", daemon=True
+        )
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return f"<LogStorage {self.path}: {len(self._table)} records>"
+
+    def __getitem__(self, key):
+        return self._table[key]
+
+    def __iter__(self):
+        return iter(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def __contains__(self, key):
+        return key in self._table
+
+    def __setitem__(self, key, record):
+        line = self._encode(_SET, key, record)
+        with self._io_lock:
+            self._check_open()
+            # The table may reject the record. It is applied first so that a
+            # rejected record never reaches the log, where it would fail again
+            # on every replay.
+            self._table[key] = record
+            self._write(line)
+
+    def __delitem__(self, key):
+        line = self._encode(_DELETE, key)
+        with self._io_lock:
+            self._check_open()
+            if key not in self._table:
+                raise KeyError(key)
+            self._write(line)
+            del self._table[key]
+
+    def clear(self):
+        line = self._encode(_CLEAR)
+        with self._io_lock:
+            self._check_open()
+            self._write(line)
+            self._table.clear()
+
+    def commit(self):
+        """Block until every write appended so far is fsynced."""
+
+        target = self._appended
+        if self._synced >= target:
+            return
+
+        self._sync_requested.set()
+        with self._synced_condition:
+            while self._synced < target and not self._closed:
+                self._synced_condition.wait()
+
+        self._maybe_compact()
+
+    def flush(self):
+        """Fsync outstanding writes from the calling thread."""
+
+        self._sync()
+
+    def close(self):
+        if self._closed:
+            return
+        self._sync()
+        with self._sync_lock, self._io_lock:
+            self._closed = True
+            self._file.close()
+        self._sync_requested.set()
+        with self._synced_condition:
+            self._synced_condition.notify_all()
+        atexit.unregister(self.close)
+
+    def compact(self):
+        """Rewrite the log so it only contains live records."""
+
+        with self._io_lock:
+            if self._compacting or self._closed:
+                return
+            self._compacting = True
+            self._file.flush()
+            offset = self._file.tell()
+            snapshot = list(self._table.items())
+
+        tmp_path = f"{self.path}.compact"
+        try:
+            with open(tmp_path, "wb") as tmp:
+                for key, record in snapshot:
+                    tmp.write(self._encode(_SET, key, record))
+
+                with self._sync_lock, self._io_lock:
+                    # Carry over writes that landed while the snapshot was
+                    # being written, then swap the files.
+                    self._file.flush()
+                    with open(self.path, "rb") as log:
+                        log.seek(offset)
+                        tail = log.read()
+                    tmp.write(tail)
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+
+                    self._file.close()
+                    os.replace(tmp_path, self.path)
+                    self._fsync_directory()
+                    self._file = open(self.path, "ab")
+                    self._entries = len(snapshot) + tail.count(b"\n")
+        finally:
+            self._compacting = False
+
+    def _encode(self, op, key=None, record=None) -> bytes:
+        entry = [op] if op == _CLEAR else [op, key, record]
+        return json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+
+    def _check_open(self):
+        if self._closed:
+            raise lib.DatastoreException(f"Log storage {self.path} is closed.")
+
+    def _write(self, line: bytes):
+        self._file.write(line)
+        self._entries += 1
+        self._appended += 1
+
+    def _recover(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+
+        with open(self.path, "r+b") as log:
+            data = log.read()
+
+            # Anything after the last newline is a partially written entry
+            # left behind by a crash. It is the only part of the log that is
+            # ever dropped.
+            valid_size = data.rfind(b"\n") + 1
+            if valid_size != len(data):
+                data = data[:valid_size]
+                log.truncate(valid_size)
+
+        entries = self._parse(data)
+
+        table = self._table
+        for entry in entries:
+            op = entry[0]
+            if op == _SET:
+                table[entry[1]] = entry[2]
+            elif op == _DELETE:
+                table.pop(entry[1], None)
+            elif op == _CLEAR:
+                table.clear()
+        self._entries = len(entries)
+
+    def _parse(self, data: bytes) -> list:
+        try:
+            # JSON never contains raw newlines, so the whole log can be
+            # parsed as a single array, which is much faster than parsing it
+            # line by line.
+            return json.loads(b"[" + data[:-1].replace(b"\n", b",") + b"]")
+        except ValueError:
+            pass
+
+        # Find the offending entry to report it. Complete entries that fail to
+        # parse mean the log is corrupt, so nothing is discarded.
+        for number, line in enumerate(data.splitlines(), start=1):
+            try:
+                json.loads(line)
+            except ValueError:
+                raise lib.DatastoreException(
+                    f"Log {self.path} is corrupt at line {number}."
+                )
+        raise lib.DatastoreException(f"Log {self.path} is corrupt.")
+
+    def _sync(self):
+        with self._sync_lock:
+            with self._io_lock:
+                if self._closed:
+                    return
+                target = self._appended
+                self._file.flush()
+
+            # Writers may keep appending while the fsync is in flight. They
+            # are picked up by the next group.
+            os.fsync(self._file.fileno())
+
+        with self._synced_condition:
+            self._synced = max(self._synced, target)
+            self._synced_condition.notify_all()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._sync_requested.wait(timeout=self.sync_interval)
+            self._sync_requested.clear()
+            if self._closed:
+                break
+            if self._synced < self._appended:
+                self._sync()
+
+    def _maybe_compact(self):
+        live = len(self._table)
+        if self._compacting or self._entries < self.compact_min_entries:
+            return
+        if (self._entries - live) / self._entries < self.compact_ratio:
+            return
+
+        threading.Thread(
+            target=self.compact, name=f"LogStorage compactor {self.path}", daemon=True
+        ).start()
+
+    def _fsync_directory(self):
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class ObjectMapStorage(collections.abc.MutableMapping):
+    """
+    Compact storage for ObjectMap records of the shape
+    ``{"local_id": int, "remote_id": str}``.
+
+    Instead of a dict per record, integer keys live in an open-addressed hash
+    table backed by an `array` and remote ids are packed into a fixed-width
+    `bytearray` slot next to them. A mapping costs roughly
+    ``(8 + width + 1) / load_factor`` bytes. Records are materialized as new
+    dicts when read.
+    """
+
+    _EMPTY = -(2 ** 63)
+    _DELETED = -(2 ** 63) + 1
+    _NONE = 0xFF
+    _MULTIPLIER = 0x9E3779B97F4A7C15
+    _MASK = 2 ** 64 - 1
+
+    def __init__(
+        self,
+        key_field: str = "local_id",
+        value_field: str = "remote_id",
+        width: int = 16,
+        capacity: int = 1024,
+        load_factor: float = 0.7,
+    ):
+        """
+        Args:
+            width: Longest remote id, in bytes, that can be stored.
+            capacity: Initial number of slots. Rounded up to a power of two.
+            load_factor: Fraction of used slots that triggers a resize.
+        """
+        if not 0 < width < self._NONE:
+            raise ValueError(f"Width must be between 1 and {self._NONE - 1}.")
+
+        self.key_field = key_field
+        self.value_field = value_field
+        self.width = width
+        self.load_factor = load_factor
+        self._allocate(max(8, 1 << (capacity - 1).bit_length()))
+
+    def __repr__(self):
+        return f"<ObjectMapStorage: {self._size} records, {self._capacity} slots>"
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        keys = self._keys
+        for slot in range(self._capacity):
+            key = keys[slot]
+            if key != self._EMPTY and key != self._DELETED:
+                yield key
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        slot = self._find(key)
+        if slot < 0:
+            raise KeyError(key)
+        return {self.key_field: key, self.value_field: self._read_value(slot)}
+
+    def __setitem__(self, key, record):
+        encoded = self._encode_value(record.get(self.value_field))
+        slot = self._find(key)
+        if slot < 0:
+            if (self._used + 1) > self._capacity * self.load_factor:
+                self._resize()
+            slot = self._insert_slot(key)
+        self._write_value(slot, encoded)
+
+    def __delitem__(self, key):
+        slot = self._find(key)
+        if slot < 0:
+            raise KeyError(key)
+        self._keys[slot] = self._DELETED
+        self._size -= 1
+
+    def clear(self):
+        self._allocate(8)
+
+    def nbytes(self) -> int:
+        """Bytes used by the underlying arrays."""
+
+        return self._keys.itemsize * len(self._keys) + len(self._values)
+
+    def _allocate(self, capacity: int):
+        self._capacity = capacity
+        self._bits = capacity.bit_length() - 1
+        self._keys = array.array("q", [self._EMPTY]) * capacity
+        self._values = bytearray((self.width + 1) * capacity)
+        self._size = 0
+        # Used slots include tombstones left behind by removed keys.
+        self._used = 0
+
+    def _slot(self, key: int) -> int:
+        # Fibonacci hashing spreads sequential local ids across the table.
+        return ((key * self._MULTIPLIER) & self._MASK) >> (64 - self._bits)
+
+    def _check_key(self, key):
+        if (
+            not isinstance(key, int)
+            or isinstance(key, bool)
+            or not self._DELETED < key < 2 ** 63
+        ):
+            raise lib.DatastoreException(
+                f"Key '{key}' must be a 64-bit integer to be stored in an ObjectMap."
+            )
+
+    def _find(self, key) -> int:
+        if not isinstance(key, int):
+            return -1
+
+        keys = self._keys
+        mask = self._capacity - 1
+        slot = self._slot(key)
+        while True:
+            current = keys[slot]
+            if current == key:
+                return slot
+            if current == self._EMPTY:
+                return -1
+            slot = (slot + 1) & mask
+
+    def _insert_slot(self, key) -> int:
+        self._check_key(key)
+
+        keys = self._keys
+        mask = self._capacity - 1
+        slot = self._slot(key)
+        while True:
+            current = keys[slot]
+            if current == self._EMPTY or current == self._DELETED:
+                if current == self._EMPTY:
+                    self._used += 1
+                keys[slot] = key
+                self._size += 1
+                return slot
+            slot = (slot + 1) & mask
+
+    def _resize(self):
+        live = [
+            (key, self._values[self._offset(slot) : self._offset(slot + 1)])
+            for slot, key in enumerate(self._keys)
+            if key != self._EMPTY and key != self._DELETED
+        ]
+
+        capacity = self._capacity
+        # Only grow when the table is mostly live keys rather than tombstones,
+        # otherwise rebuilding at the same size is enough to reclaim slots.
+        if (len(live) + 1) * 2 > capacity * self.load_factor:
+            capacity *= 2
+        self._allocate(capacity)
+
+        for key, encoded in live:
+            slot = self._insert_slot(key)
+            offset = self._offset(slot)
+            self._values[offset : offset + self.width + 1] = encoded
+
+    def _offset(self, slot: int) -> int:
+        return slot * (self.width + 1)
+
+    def _encode_value(self, value) -> bytes:
+        if value is None:
+            return bytes([self._NONE])
+
+        try:
+            encoded = str(value).encode("ascii")
+        except UnicodeEncodeError:
+            raise lib.DatastoreException(f"Remote id '{value}' must be ASCII.")
+        if len(encoded) > self.width:
+            raise lib.DatastoreException(
+                f"Remote id '{value}' is longer than {self.width} bytes."
+            )
+        return bytes([len(encoded)]) + encoded
+
+    def _write_value(self, slot: int, encoded: bytes):
+        offset = self._offset(slot)
+        self._values[offset : offset + len(encoded)] = encoded
+
+    def _read_value(self, slot: int) -> typing.Optional[str]:
+        offset = self._offset(slot)
+        length = self._values[offset]
+        if length == self._NONE:
+            return None
+        return self._values[offset + 1 : offset + 1 + length].decode("ascii")
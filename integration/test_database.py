@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+from integration import lib
+from integration import database
+
+
+def test_local_stores_record_changes():
+    start = database.BillStore.sequence
+    key = database.BillStore.save(
+        {"invoice_number": "INV1", "vendor_id": 1, "currency_id": 1, "items": []}
+    )
+    database.BillStore.remove(key)
+
+    changes = list(database.BillStore.changes(since=start))
+    assert [(c.op, c.key) for c in changes] == [
+        (lib.ChangeOp.SAVE, key),
+        (lib.ChangeOp.REMOVE, key),
+    ]
+    assert all(
+        store.changefeed is not None
+        for store in database.entity_datastore_mapping.values()
+    )
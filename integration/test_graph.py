@@ -33,6 +33,11 @@ class House(lib.SyncEntity):
     appliances: typing.List[Appliance]
 
 
+@dataclasses.dataclass(eq=False, frozen=True)
+class Floor(lib.SyncEntity):
+    supports: typing.List["Floor"]
+
+
 @pytest.fixture
 def house():
     stove = Appliance(local_id=1, remote_id=None, name="Stove")
@@ -78,6 +83,23 @@ class TestGraph:
         laundry_washer = node.deps[0].deps[1]
         assert house_washer == laundry_washer
 
+    def test_field_plan(self):
+        plan = lib.field_plan(Room)
+        assert plan.dependencies == (
+            ("windows", lib.FieldKind.LIST),
+            ("appliance", lib.FieldKind.OPTIONAL),
+        )
+        assert ("fans", lib.FieldKind.SCALAR, typing.Optional[int]) in plan.fields
+        supports = lib.field_plan(Floor).fields[-1]
+        assert supports == ("supports", lib.FieldKind.LIST, Floor)
+        assert lib.field_plan(Room) is plan
+
+    def test_scalar_optionals_are_not_dependencies(self):
+        room = Room(
+            local_id=2, remote_id=None, name="Den", windows=[], appliance=None, fans=2
+        )
+        assert graph.generate_graph(room).deps == []
+
     def test_can_traverse_graph(self, house):
         node = graph.generate_graph(house)
         deps = graph.resolve_dependencies(node)
@@ -92,3 +114,139 @@ class TestGraph:
         assert stove.name == "Stove"
         assert room.name == "Laundry Room"
         assert _house == house
+
+    def test_dependencies_are_unique_by_identity(self):
+        node = graph.Node(Window(local_id=1, remote_id=None, width=1, height=1))
+        stove = Appliance(local_id=1, remote_id=None, name="Stove")
+        node.add_dependency(graph.Node(stove))
+        node.add_dependency(graph.Node(stove))
+        node.add_dependency(graph.Node(Room(1, None, "Den", [], None)))
+        assert len(node.deps) == 2
+
+    def test_compact_graph(self, house):
+        root = graph.generate_graph(house)
+        compact = graph.CompactGraph(root)
+
+        assert len(compact) == 5
+        assert compact.entities[0] == house
+        assert list(compact.dependencies(0)) == [1, 2, 3]
+        assert compact.resolve_dependencies() == graph.resolve_dependencies(root)
+
+        first = graph.Node(Appliance(local_id=1, remote_id=None, name="Stove"))
+        second = graph.Node(Appliance(local_id=2, remote_id=None, name="Washer"))
+        first.add_dependency(second)
+        second.add_dependency(first)
+        with pytest.raises(graph.CycleError) as error:
+            graph.CompactGraph(first).resolve_dependencies()
+        assert [entity.local_id for entity in error.value.path] == [1, 2, 1]
+
+    def test_prunes_synced_dependencies(self, house):
+        stove = Appliance(local_id=1, remote_id="r1", name="Stove")
+        window = Window(local_id=1, remote_id=None, width=2, height=4)
+        room = Room(
+            local_id=1, remote_id="r2", name="Den", windows=[window], appliance=None
+        )
+        synced = House(
+            local_id=1, remote_id="r3", name="A", rooms=[room], appliances=[stove]
+        )
+
+        assert graph.resolve_dependencies(graph.generate_graph(synced)) == [synced]
+        deps = graph.resolve_dependencies(graph.generate_graph(synced, force=True))
+        assert len(deps) == 4
+
+    def test_can_merge_graphs(self, house):
+        # A second house sharing the washer, plus the laundry room on its own.
+        washer = Appliance(local_id=2, remote_id=None, name="Washer")
+        other = House(
+            local_id=2, remote_id=None, name="B House", rooms=[], appliances=[washer]
+        )
+        laundry_room = house.rooms[0]
+
+        nodes = graph.generate_graph_many([house, other, laundry_room])
+        assert nodes[2] is nodes[0].deps[0]
+        assert nodes[1].deps[0] is nodes[0].deps[0].deps[1]
+
+        deps = graph.resolve_dependencies_many(nodes)
+        assert [(type(e).__name__, e.local_id) for e in deps] == [
+            ("Appliance", 2),
+            ("Window", 1),
+            ("Appliance", 1),
+            ("Room", 1),
+            ("House", 2),
+            ("House", 1),
+        ]
+        waves = graph.resolve_waves_many(nodes)
+        assert [len(wave) for wave in waves] == [3, 2, 1]
+
+    def test_can_resolve_waves(self, house):
+        waves = graph.resolve_waves(graph.generate_graph(house))
+
+        assert [[entity.local_id for entity in wave] for wave in waves] == [
+            [2, 1, 1],
+            [1],
+            [1],
+        ]
+        washer, window, stove = waves[0]
+        assert washer.name == "Washer" and window.width == 2
+        assert waves[1][0].name == "Laundry Room" and waves[2][0] == house
+
+    def test_dependencies_come_first(self):
+        # Stack of diamonds: every floor rests on both floors of the level
+        # below. The number of paths doubles with each level.
+        below = [Floor(local_id=0, remote_id=None, supports=[])]
+        for level in range(1, 40):
+            below = [
+                Floor(local_id=level * 2 + i, remote_id=None, supports=below)
+                for i in range(2)
+            ]
+        top = Floor(local_id=100, remote_id=None, supports=below)
+
+        deps = graph.resolve_dependencies(graph.generate_graph(top))
+
+        assert len(deps) == 80
+        assert deps[-1] == top
+        position = {entity.local_id: i for i, entity in enumerate(deps)}
+        for entity in deps:
+            for dep in entity.supports:
+                assert position[dep.local_id] < position[entity.local_id]
+
+        waves = graph.resolve_waves(graph.generate_graph(top))
+        assert [len(wave) for wave in waves] == [1] + [2] * 39 + [1]
+
+    def test_can_handle_deep_graphs(self):
+        floor = Floor(local_id=0, remote_id=None, supports=[])
+        for level in range(1, 20000):
+            floor = Floor(local_id=level, remote_id=None, supports=[floor])
+
+        deps = graph.resolve_dependencies(graph.generate_graph(floor))
+        assert [entity.local_id for entity in deps] == list(range(20000))
+
+    def test_reports_cycles(self):
+        ground = Floor(local_id=1, remote_id=None, supports=[])
+        first = Floor(local_id=2, remote_id=None, supports=[ground])
+        second = Floor(local_id=3, remote_id=None, supports=[first])
+        ground.supports.append(second)
+
+        with pytest.raises(graph.CycleError) as error:
+            graph.generate_graph(second)
+        assert [entity.local_id for entity in error.value.path] == [3, 2, 1, 3]
+        assert str(error.value) == (
+            "Dependency cycle: Floor(3) -> Floor(2) -> Floor(1) -> Floor(3)"
+        )
+
+        # A different instance with the same identity is the same entity.
+        itself = Floor(local_id=4, remote_id=None, supports=[])
+        with pytest.raises(graph.CycleError):
+            graph.generate_graph(Floor(local_id=4, remote_id=None, supports=[itself]))
+
+    def test_resolution_reports_cycles(self):
+        first = graph.Node(Floor(local_id=1, remote_id=None, supports=[]))
+        second = graph.Node(Floor(local_id=2, remote_id=None, supports=[]))
+        first.add_dependency(second)
+        second.add_dependency(first)
+
+        root = graph.Node(Floor(local_id=3, remote_id=None, supports=[]))
+        root.add_dependency(first)
+        with pytest.raises(graph.CycleError) as error:
+            graph.resolve_dependencies(root)
+        assert [entity.local_id for entity in error.value.path] == [1, 2, 1]
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
 import pytest
+import random
+import typing
+import threading
 import dataclasses
 from integration import lib
 
@@ -33,6 +36,29 @@ class TestSyncEntity:
         house1 = House(local_id=1, remote_id=None, size=1000, beds=2, baths=2)
         house2 = House(local_id=1, remote_id=None, size=2000, beds=4, baths=2)
         assert house1 == house2
+        assert hash(house1) == hash(house2)
+        assert house1.identity == (House, 1)
+
+        @dataclasses.dataclass(eq=False, frozen=True)
+        class House(lib.SyncEntity):
+            pass
+
+        # Unrelated classes sharing a name are different entities.
+        assert house1 != House(local_id=1, remote_id=None)
+        assert house1 != 1
+
+    def test_interning(self, House):
+        house1 = House(local_id=1, remote_id=None, size=1000, beds=2, baths=2)
+        house2 = House(local_id=1, remote_id=None, size=1000, beds=2, baths=2)
+        assert lib.intern(house2) is house2
+
+        with lib.interning() as table:
+            assert lib.intern(house1) is house1
+            assert lib.intern(house2) is house1
+            with lib.interning():
+                assert lib.intern(house2) is house2
+            assert len(table) == 1
+        assert lib.intern(house2) is house2
 
     def test_can_serialize(self, house):
         data = house.serialize()
@@ -40,8 +66,556 @@ class TestSyncEntity:
         assert data["local_id"] == house.local_id
         assert data["size"] == house.size
 
+    def test_nested_serialization(self):
+        @dataclasses.dataclass(eq=False, frozen=True)
+        class Owner(lib.SyncEntity):
+            name: str
+
+        @dataclasses.dataclass(eq=False, frozen=True)
+        class Street(lib.SyncEntity):
+            owner: Owner
+            mayor: typing.Optional[Owner]
+            residents: typing.List[Owner]
+            name: str = "Main"
+
+        owner = Owner(local_id=2, remote_id="r2", name="Ann")
+        street = Street(
+            local_id=1, remote_id=None, owner=owner, mayor=None, residents=[owner]
+        )
+        assert street.serialize() == {
+            "local_id": 1,
+            "remote_id": None,
+            "owner_id": "r2",
+            "mayor_id": None,
+            "residents": [{"local_id": 2, "remote_id": "r2", "name": "Ann"}],
+            "name": "Main",
+        }
+
+        street = Street.deserialize(
+            {
+                "local_id": 1,
+                "remote_id": None,
+                "owner": {"local_id": 2, "remote_id": "r2", "name": "Ann"},
+                "mayor": owner,
+                "residents": [{"local_id": 3, "remote_id": None, "name": "Bo"}],
+            }
+        )
+        assert street.owner == owner and street.owner.name == "Ann"
+        assert street.mayor is owner
+        assert street.residents[0].name == "Bo" and street.name == "Main"
+
+        # Data written by serialize holds dependencies by their remote id.
+        street = Street(
+            local_id=1,
+            remote_id="r1",
+            owner=owner,
+            mayor=Owner(local_id=4, remote_id="r4", name="Cy"),
+            residents=[owner],
+        )
+        data = street.serialize()
+        restored = Street.deserialize(data)
+        assert restored.serialize() == data
+        assert restored.owner.remote_id == "r2" and restored.owner.local_id is None
+        assert restored.owner != restored.mayor
+        assert restored.residents == [owner]
+        assert Street.deserialize({**data, "mayor_id": None}).mayor is None
+
     def test_can_deserialize(self, House):
         house = House.deserialize(
             {"local_id": 999, "remote_id": None, "size": 1000, "beds": 2, "baths": 1}
         )
         assert house.local_id == 999
+
+
+@pytest.fixture
+def store():
+    return lib.Datastore(
+        name="Currency",
+        fields=("id", "name", "iso_code"),
+        indexes=("name",),
+        unique_indexes=("iso_code",),
+    )
+
+
+class TestDatastore:
+    def test_can_find_by_index(self, store):
+        cad = store.save({"name": "Dollar", "iso_code": "CAD"})
+        usd = store.save({"name": "Dollar", "iso_code": "USD"})
+
+        assert store.is_indexed("name")
+        assert [r["id"] for r in store.find("name", "Dollar")] == [cad, usd]
+        assert store.find("iso_code", "USD")[0]["id"] == usd
+        assert store.find("iso_code", "GBP") == []
+
+    def test_index_follows_updates(self, store):
+        key = store.save({"name": "Dollar", "iso_code": "CAD"})
+        store.save({"id": key, "name": "Loonie", "iso_code": "CAD"})
+        assert store.find("name", "Dollar") == []
+        assert store.find("name", "Loonie")[0]["id"] == key
+
+        store.remove(key)
+        assert store.find("iso_code", "CAD") == []
+
+        store.save({"name": "Pound", "iso_code": "GBP"})
+        store.reset()
+        assert store.find("iso_code", "GBP") == []
+
+    def test_unique_index_rejects_duplicates(self, store):
+        store.save({"name": "Dollar", "iso_code": "CAD"})
+        with pytest.raises(lib.DatastoreException):
+            store.save({"name": "Other Dollar", "iso_code": "CAD"})
+        assert len(store.retrieve()) == 1
+
+    def test_can_find_unindexed_field(self, store):
+        key = store.save({"name": "Dollar", "iso_code": "CAD", "symbol": "$"})
+        assert store.find("symbol", "$")[0]["id"] == key
+
+    def test_reads_never_fail_during_writes(self, store):
+        keys = [
+            store.save({"name": "Dollar", "iso_code": f"C{i}"}) for i in range(10)
+        ]
+        errors = []
+        done = threading.Event()
+
+        def write():
+            for i in range(2000):
+                body = {"id": keys[i % 10], "name": "Dollar", "iso_code": f"C{i % 10}"}
+                store.save(body)
+            done.set()
+
+        def read():
+            while not done.is_set():
+                try:
+                    assert len(store.retrieve()) == 10
+                    assert store.retrieve(keys[0], raise_exception=True)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=write)]
+        threads += [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+
+    def test_retrieve_missing_key(self, store):
+        assert store.retrieve("missing") is None
+        with pytest.raises(lib.DatastoreException):
+            store.retrieve("missing", raise_exception=True)
+
+    def test_can_save_many(self, store):
+        keys = store.save_many(
+            [
+                {"name": "Dollar", "iso_code": "CAD"},
+                {"id": "usd", "name": "Dollar", "iso_code": "USD"},
+            ]
+        )
+        assert keys[1] == "usd"
+        assert len(store.retrieve()) == 2
+        assert store.find("iso_code", "CAD")[0]["id"] == keys[0]
+
+    def test_save_many_is_all_or_nothing(self, store):
+        store.save({"name": "Pound", "iso_code": "GBP"})
+
+        with pytest.raises(lib.DatastoreException):
+            store.save_many(
+                [
+                    {"name": "Dollar", "iso_code": "CAD"},
+                    {"name": "Dollar"},  # Missing required field
+                ]
+            )
+        with pytest.raises(lib.DatastoreException):
+            store.save_many(
+                [
+                    {"name": "Dollar", "iso_code": "CAD"},
+                    {"name": "Other Dollar", "iso_code": "CAD"},
+                ]
+            )
+        assert len(store.retrieve()) == 1
+
+    def test_can_retrieve_and_remove_many(self, store):
+        keys = store.save_many(
+            [{"name": "Dollar", "iso_code": code} for code in ("CAD", "USD", "GBP")]
+        )
+        found = store.retrieve_many([keys[0], keys[2], "missing"])
+        assert list(found) == [keys[0], keys[2]]
+
+        store.remove_many(keys[:2])
+        assert [r["id"] for r in store.retrieve()] == [keys[2]]
+        assert store.find("iso_code", "CAD") == []
+
+    def test_can_count(self, store):
+        store.save_many(
+            [
+                {"name": "Dollar", "iso_code": "CAD", "symbol": "$"},
+                {"name": "Dollar", "iso_code": "USD", "symbol": "$"},
+                {"name": "Pound", "iso_code": "GBP", "symbol": "£"},
+            ]
+        )
+        assert store.count() == 3
+        assert store.count("name", "Dollar") == 2
+        assert store.count("symbol", "£") == 1
+        assert store.count("name", ["Dollar"]) == 0
+
+    def test_can_iterate_in_key_order(self, store):
+        keys = [f"k{i:02d}" for i in range(25)]
+        store.save_many(
+            {"id": key, "name": "Dollar", "iso_code": key} for key in reversed(keys)
+        )
+
+        assert [r["id"] for r in store.iterate(batch_size=4)] == keys
+        assert [r["id"] for r in store.iterate(limit=3, after_key="k10")] == [
+            "k11",
+            "k12",
+            "k13",
+        ]
+
+        records, cursor = store.page(limit=10)
+        assert [r["id"] for r in records] == keys[:10]
+        records, cursor = store.page(limit=10, after_key=cursor)
+        assert records[0]["id"] == "k10"
+        records, cursor = store.page(limit=10, after_key=cursor)
+        assert len(records) == 5 and cursor is None
+
+    def test_iteration_sees_later_writes(self, store):
+        store.save_many(
+            {"id": f"k{i}", "name": "Dollar", "iso_code": f"k{i}"} for i in range(3)
+        )
+        seen = []
+        for record in store.iterate(batch_size=1):
+            seen.append(record["id"])
+            if record["id"] == "k0":
+                store.remove("k1")
+                store.save({"id": "k5", "name": "Dollar", "iso_code": "k5"})
+        assert seen == ["k0", "k2", "k5"]
+
+    def test_can_iterate_mixed_key_types(self, store):
+        store.save_many(
+            {"id": key, "name": "Dollar", "iso_code": str(key)}
+            for key in ("b", 2, "a", 1)
+        )
+        assert [r["id"] for r in store.iterate()] == [1, 2, "a", "b"]
+        assert [r["id"] for r in store.iterate(after_key=2)] == ["a", "b"]
+
+        store.remove(1)
+        store.save({"id": 0, "name": "Dollar", "iso_code": "0"})
+        assert [r["id"] for r in store.iterate()] == [0, 2, "a", "b"]
+
+    def test_sorted_keys_follow_writes(self):
+        rng = random.Random(0)
+        keys = lib._SortedKeys(rng.sample(range(1000), 100), load=4)
+        expected = sorted(keys.after(None, 1000))
+        for _ in range(500):
+            item = rng.randrange(1000)
+            if item in expected:
+                keys.remove(item)
+                expected.remove(item)
+            else:
+                keys.add(item)
+                expected.append(item)
+                expected.sort()
+        assert keys.after(None, 1000) == expected
+        assert keys.after(expected[10], 20) == expected[11:31]
+        assert keys.after(expected[-1], 5) == []
+
+    def test_change_feed(self):
+        store = lib.Datastore(
+            name="Currency",
+            fields=("id", "name", "iso_code"),
+            changefeed=lib.ChangeFeed(),
+        )
+        start = store.sequence
+        cad = store.save({"name": "Dollar", "iso_code": "CAD"})
+        store.save_many([{"id": cad, "name": "Loonie", "iso_code": "CAD"}])
+        store.remove(cad)
+        store.reset()
+
+        changes = list(store.changes(since=start))
+        assert [c.seq for c in changes] == [start + i for i in range(1, 5)]
+        assert [c.op for c in changes] == [
+            lib.ChangeOp.SAVE,
+            lib.ChangeOp.SAVE,
+            lib.ChangeOp.REMOVE,
+            lib.ChangeOp.RESET,
+        ]
+        assert changes[1].key == cad and changes[1].record["name"] == "Loonie"
+        assert list(store.changes(since=store.sequence)) == []
+
+    def test_change_feed_is_opt_in(self, store):
+        store.save({"name": "Dollar", "iso_code": "CAD"})
+        assert store.changefeed is None and store.sequence == 0
+        with pytest.raises(lib.DatastoreException):
+            store.changes()
+
+    def test_change_feed_retention(self):
+        store = lib.Datastore(
+            name="Vendor",
+            fields=("local_id", "remote_id"),
+            pk="local_id",
+            changefeed=lib.ChangeFeed(retention=5),
+        )
+        store.save_many({"local_id": i, "remote_id": "x"} for i in range(10))
+
+        assert [c.key for c in store.changes(since=7)] == [7, 8, 9]
+        assert len(list(store.changes(since=5))) == 5
+        with pytest.raises(lib.ChangeFeedExpired):
+            store.changes(since=4)
+        with pytest.raises(lib.ChangeFeedExpired):
+            store.changes(since=11)
+
+
+class TestKeyAllocator:
+    def test_random_keys_never_collide(self):
+        store = lib.Datastore(
+            name="Digits",
+            fields=("id",),
+            key_allocator=lib.RandomKeyAllocator(keyspace="0123456789", length=2),
+        )
+        keys = store.save_many({} for _ in range(30))
+        keys += [store.save({}) for _ in range(30)]
+        assert len(set(keys)) == 60
+
+        # Take every remaining key in the keyspace.
+        store.save_many(
+            {"id": key} for key in (f"{i:02d}" for i in range(100)) if key not in keys
+        )
+        with pytest.raises(lib.DatastoreException):
+            store.save({})
+
+    def test_sequence_skips_taken_keys(self):
+        store = lib.Datastore(
+            name="Item", fields=("id",), key_allocator=lib.SequenceKeyAllocator()
+        )
+        store.save({"id": 2})
+        assert [store.save({}) for _ in range(3)] == [1, 3, 4]
+
+    def test_block_keys_are_unique_across_threads(self):
+        store = lib.Datastore(
+            name="Item",
+            fields=("id",),
+            key_allocator=lib.BlockKeyAllocator(block_size=16),
+        )
+        keys = []
+
+        def insert():
+            keys.extend(store.save({}) for _ in range(100))
+
+        threads = [threading.Thread(target=insert) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(set(keys)) == 800
+        assert len(store) == 800
+
+    def test_sharded_keys_are_unique(self):
+        store = lib.ShardedDatastore(
+            name="Digits",
+            fields=("id",),
+            key_allocator=lib.RandomKeyAllocator(keyspace="0123456789", length=2),
+            shard_count=4,
+        )
+        keys = store.save_many({} for _ in range(30))
+        keys += [store.save({}) for _ in range(30)]
+        assert len(set(keys)) == 60
+
+
+class TestReadWriteLock:
+    def test_readers_share_lock(self):
+        lock = lib.ReadWriteLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def read():
+            with lock.read():
+                acquired.set()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        assert acquired.wait(timeout=1)
+        thread.join()
+        lock.release_read()
+
+    def test_writer_excludes_readers(self):
+        lock = lib.ReadWriteLock()
+        lock.acquire_write()
+        acquired = threading.Event()
+
+        def read():
+            with lock.read():
+                acquired.set()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        assert not acquired.wait(timeout=0.05)
+        lock.release_write()
+        assert acquired.wait(timeout=1)
+        thread.join()
+
+
+@pytest.fixture
+def sharded_store():
+    return lib.ShardedDatastore(
+        name="Vendor",
+        fields=("local_id", "remote_id"),
+        pk="local_id",
+        indexes=("remote_id",),
+        shard_count=4,
+    )
+
+
+class TestShardedDatastore:
+    def test_can_save_and_retrieve(self, sharded_store):
+        for i in range(10):
+            sharded_store.save({"local_id": i, "remote_id": f"r{i}"})
+        key = sharded_store.save({"remote_id": "generated"})
+
+        assert sharded_store.retrieve(3) == {"local_id": 3, "remote_id": "r3"}
+        assert sharded_store.retrieve(key)["remote_id"] == "generated"
+        assert len(sharded_store.retrieve()) == 11
+        assert repr(sharded_store) == "<Vendor Datastore: 11 records>"
+
+        # Keys are spread across shards.
+        assert all(len(shard) for shard in sharded_store.shards)
+
+    def test_batch_operations(self, sharded_store):
+        keys = sharded_store.save_many(
+            [{"local_id": i, "remote_id": f"r{i}"} for i in range(20)]
+        )
+        assert keys == list(range(20))
+        assert sharded_store.find("remote_id", "r7")[0]["local_id"] == 7
+        assert set(sharded_store.retrieve_many([1, 2, 99])) == {1, 2}
+
+        sharded_store.remove_many(range(10))
+        sharded_store.remove(10)
+        assert len(sharded_store) == 9
+
+        with pytest.raises(lib.DatastoreException):
+            sharded_store.save_many([{"local_id": 50, "remote_id": "x"}, {}])
+        assert sharded_store.retrieve(50) is None
+
+        sharded_store.reset()
+        assert repr(sharded_store) == "<Vendor Datastore: 0 records>"
+
+    def test_can_iterate_in_key_order(self, sharded_store):
+        sharded_store.save_many(
+            [{"local_id": i, "remote_id": "x"} for i in reversed(range(30))]
+        )
+        assert [r["local_id"] for r in sharded_store.iterate()] == list(range(30))
+        assert sharded_store.count("remote_id", "x") == 30
+
+        records, cursor = sharded_store.page(limit=20, after_key=5)
+        assert records[0]["local_id"] == 6 and cursor == 25
+
+    def test_shards_share_change_feed(self):
+        sharded_store = lib.ShardedDatastore(
+            name="Vendor",
+            fields=("local_id", "remote_id"),
+            pk="local_id",
+            changefeed=lib.ChangeFeed(),
+            shard_count=4,
+        )
+        sharded_store.save_many({"local_id": i, "remote_id": "x"} for i in range(8))
+        sharded_store.remove(3)
+
+        changes = list(sharded_store.changes())
+        assert [c.seq for c in changes] == list(range(1, 10))
+        assert changes[-1].op == lib.ChangeOp.REMOVE and changes[-1].key == 3
+
+        sharded_store.reset()
+        changes = list(sharded_store.changes(since=9))
+        assert [c.op for c in changes] == [lib.ChangeOp.RESET]
+        assert len(sharded_store) == 0
+
+    def test_failed_batch_releases_reserved_keys(self):
+        class Exhausted(lib.SequenceKeyAllocator):
+            def allocate(self, exists):
+                key = super().allocate(exists)
+                if key > 2:
+                    raise lib.DatastoreException("Keyspace exhausted.")
+                return key
+
+        sharded_store = lib.ShardedDatastore(
+            name="Vendor", fields=("id", "name"), key_allocator=Exhausted()
+        )
+
+        with pytest.raises(lib.DatastoreException, match="exhausted"):
+            sharded_store.save_many({"name": name} for name in "abc")
+        assert sharded_store._reserved == set()
+        assert len(sharded_store) == 0
+
+    def test_save_many_is_atomic_across_shards(self, sharded_store):
+        sharded_store.save({"local_id": 1, "remote_id": "x"})
+        batch = [{"local_id": i, "remote_id": ["unhashable"]} for i in range(2, 6)]
+        batch[0]["remote_id"] = "fine"
+
+        with pytest.raises(lib.DatastoreException):
+            sharded_store.save_many(batch)
+        assert len(sharded_store) == 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+    def test_allows_burst_then_paces(self):
+        clock = FakeClock()
+        bucket = lib.TokenBucket(rate=10, burst=2, clock=clock)
+
+        assert [bucket.reserve() for _ in range(4)] == pytest.approx(
+            [0, 0, 0.1, 0.2]
+        )
+        clock.now = 1.0
+        assert bucket.reserve() == 0
+
+    def test_try_acquire_does_not_take_unavailable_tokens(self):
+        clock = FakeClock()
+        bucket = lib.TokenBucket(rate=10, clock=clock)
+
+        assert bucket.try_acquire() == 0
+        assert bucket.try_acquire() == pytest.approx(0.1)
+        assert bucket.try_acquire() == pytest.approx(0.1)
+        clock.now = 0.1
+        assert bucket.try_acquire() == 0
+
+    def test_pause_holds_back_tokens(self):
+        clock = FakeClock()
+        bucket = lib.TokenBucket(rate=10, burst=5, clock=clock)
+
+        bucket.pause(2)
+        assert bucket.reserve() == pytest.approx(2)
+        assert bucket.reserve() == pytest.approx(2.1)
+        clock.now = 2.0
+        assert bucket.try_acquire() == pytest.approx(0.2)
+
+    def test_shared_between_threads(self):
+        bucket = lib.TokenBucket(rate=1, burst=10)
+        waits = []
+
+        def reserve():
+            waits.append(bucket.reserve())
+
+        threads = [threading.Thread(target=reserve) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sum(1 for wait in waits if wait == 0) == 10
+        assert max(waits) == pytest.approx(10, abs=0.1)
+
+    def test_limiter_ignores_unconfigured_endpoints(self):
+        limiter = lib.RateLimiter({"/vendors": (1, 1)})
+
+        assert limiter.reserve("/vendors") == 0
+        assert limiter.reserve("/vendors") > 0
+        assert limiter.reserve("/locations") == 0
+        limiter.pause("/locations", 5)
+        assert limiter.reserve("/locations") == 0
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import pytest
+from integration import lib
+from integration import storage
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "objectmap.log")
+
+
+def object_map(path, **kwargs):
+    return lib.Datastore(
+        name="Vendor",
+        fields=("local_id", "remote_id"),
+        pk="local_id",
+        indexes=("remote_id",),
+        storage=storage.LogStorage(path, **kwargs),
+    )
+
+
+class TestLogStorage:
+    def test_records_survive_restart(self, log_path):
+        store = object_map(log_path)
+        store.save({"local_id": 1, "remote_id": "abc"})
+        store.save_many([{"local_id": i, "remote_id": f"r{i}"} for i in range(2, 5)])
+        store.save({"local_id": 2, "remote_id": "updated"})
+        store.remove(3)
+
+        reopened = object_map(log_path)
+        assert reopened.retrieve(1) == {"local_id": 1, "remote_id": "abc"}
+        assert reopened.retrieve(2)["remote_id"] == "updated"
+        assert reopened.retrieve(3) is None
+        assert len(reopened.retrieve()) == 3
+
+        # Indexes are rebuilt from the recovered records.
+        assert reopened.find("remote_id", "r4")[0]["local_id"] == 4
+
+    def test_reset_survives_restart(self, log_path):
+        store = object_map(log_path)
+        store.save({"local_id": 1, "remote_id": "abc"})
+        store.reset()
+        store.save({"local_id": 2, "remote_id": "def"})
+
+        reopened = object_map(log_path)
+        assert [r["local_id"] for r in reopened.retrieve()] == [2]
+
+    def test_ignores_partially_written_entry(self, log_path):
+        store = object_map(log_path)
+        store.save({"local_id": 1, "remote_id": "abc"})
+        with open(log_path, "ab") as log:
+            log.write(b'["s",2,{"local_id":2,')
+
+        reopened = object_map(log_path)
+        assert len(reopened.retrieve()) == 1
+
+        reopened.save({"local_id": 3, "remote_id": "ghi"})
+        assert len(object_map(log_path).retrieve()) == 2
+
+    def test_refuses_corrupt_log(self, log_path):
+        engine = storage.LogStorage(log_path)
+        for i in range(5):
+            engine[i] = {"local_id": i, "remote_id": f"r{i}"}
+        engine.close()
+
+        with open(log_path, "rb") as log:
+            lines = log.readlines()
+        lines[1] = b'["s",1,{"local_id":1,\n'
+        with open(log_path, "wb") as log:
+            log.writelines(lines)
+
+        with pytest.raises(lib.DatastoreException, match="line 2"):
+            storage.LogStorage(log_path)
+
+        # Valid records after the corrupt entry are left on disk.
+        with open(log_path, "rb") as log:
+            assert log.readlines() == lines
+
+    def test_closed_log_rejects_writes(self, log_path):
+        engine = storage.LogStorage(log_path)
+        engine[1] = {"local_id": 1, "remote_id": "abc"}
+        engine.close()
+
+        with pytest.raises(lib.DatastoreException):
+            del engine[1]
+        with pytest.raises(lib.DatastoreException):
+            engine.clear()
+        assert engine[1] == {"local_id": 1, "remote_id": "abc"}
+
+    def test_failed_save_leaves_datastore_intact(self, log_path):
+        engine = storage.LogStorage(log_path)
+        store = lib.Datastore(
+            name="Vendor", fields=("id", "name"), indexes=("name",), storage=engine
+        )
+        store.save({"id": "a", "name": "Staples"})
+        assert [r["id"] for r in store.iterate()] == ["a"]
+        engine.close()
+
+        with pytest.raises(lib.DatastoreException):
+            store.save({"id": "b", "name": "Staples"})
+        assert [r["id"] for r in store.find("name", "Staples")] == ["a"]
+        assert [r["id"] for r in store.iterate()] == ["a"]
+
+    def test_compaction_keeps_live_records(self, log_path):
+        engine = storage.LogStorage(log_path, compact_min_entries=0)
+        for i in range(100):
+            engine[i % 10] = {"local_id": i % 10, "remote_id": str(i)}
+        del engine[0]
+        engine.flush()
+
+        engine.compact()
+        engine[10] = {"local_id": 10, "remote_id": "new"}
+        engine.close()
+
+        with open(log_path) as log:
+            assert len(log.readlines()) == 10
+
+        reopened = storage.LogStorage(log_path)
+        assert len(reopened) == 10
+        assert reopened[9]["remote_id"] == "99"
+        assert reopened[10]["remote_id"] == "new"
+
+
+class TestObjectMapStorage:
+    def test_can_store_mappings(self):
+        table = storage.ObjectMapStorage(capacity=8)
+        for i in range(1000):
+            table[i] = {"local_id": i, "remote_id": f"r{i}"}
+        table[5] = {"local_id": 5, "remote_id": None}
+
+        assert len(table) == 1000
+        assert table[999] == {"local_id": 999, "remote_id": "r999"}
+        assert table[5]["remote_id"] is None
+        assert 1000 not in table
+        assert "1" not in table
+        assert sorted(table) == list(range(1000))
+
+    def test_can_remove_mappings(self):
+        table = storage.ObjectMapStorage(capacity=8)
+        for round in range(50):
+            for i in range(10):
+                table[round * 10 + i] = {"local_id": i, "remote_id": "x"}
+            for i in range(10):
+                del table[round * 10 + i]
+
+        assert len(table) == 0
+        # Tombstones are reclaimed rather than growing the table forever.
+        assert table._capacity <= 64
+        with pytest.raises(KeyError):
+            table[0]
+
+    def test_rejects_invalid_values(self):
+        table = storage.ObjectMapStorage(width=4)
+        with pytest.raises(lib.DatastoreException):
+            table["abc"] = {"local_id": "abc", "remote_id": "x"}
+        with pytest.raises(lib.DatastoreException):
+            table[1] = {"local_id": 1, "remote_id": "too long"}
+        assert len(table) == 0
+
+    def test_rejected_record_is_not_logged(self, log_path):
+        engine = storage.LogStorage(log_path, table=storage.ObjectMapStorage(width=4))
+        engine[1] = {"local_id": 1, "remote_id": "abc"}
+        with pytest.raises(lib.DatastoreException):
+            engine[2] = {"local_id": 2, "remote_id": "toolongid"}
+        engine.close()
+
+        reopened = storage.LogStorage(log_path, table=storage.ObjectMapStorage(width=4))
+        assert sorted(reopened) == [1]
+
+    def test_rejected_batch_is_not_saved(self):
+        store = lib.Datastore(
+            name="Vendor",
+            fields=("local_id", "remote_id"),
+            pk="local_id",
+            indexes=("remote_id",),
+            storage=storage.ObjectMapStorage(width=4),
+            changefeed=lib.ChangeFeed(),
+        )
+        store.save({"local_id": 1, "remote_id": "a"})
+        batch = [
+            {"local_id": 1, "remote_id": "b"},
+            {"local_id": 2, "remote_id": "c"},
+            {"local_id": 3, "remote_id": "toolongid"},
+        ]
+
+        with pytest.raises(lib.DatastoreException):
+            store.save_many(batch)
+        assert store.retrieve() == [{"local_id": 1, "remote_id": "a"}]
+        assert store.find("remote_id", "a")[0]["local_id"] == 1
+        assert store.find("remote_id", "c") == []
+        assert [r["local_id"] for r in store.iterate()] == [1]
+        assert store.sequence == 1
+
+    def test_backs_datastore(self, log_path):
+        store = lib.Datastore(
+            name="Vendor",
+            fields=("local_id", "remote_id"),
+            pk="local_id",
+            storage=storage.LogStorage(log_path, table=storage.ObjectMapStorage()),
+        )
+        store.save_many([{"local_id": i, "remote_id": f"r{i}"} for i in range(3)])
+        store.remove(1)
+
+        reopened = storage.LogStorage(log_path, table=storage.ObjectMapStorage())
+        assert isinstance(reopened._table, storage.ObjectMapStorage)
+        assert sorted(reopened) == [0, 2]
+        assert reopened[2] == {"local_id": 2, "remote_id": "r2"}